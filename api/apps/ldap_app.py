@@ -13,15 +13,22 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import hashlib
+import json
 import logging
-from flask import request
+import threading
+from functools import wraps
+
+from cachetools import TTLCache
+from flask import g, make_response, request
 from flask_login import login_required, current_user, login_user
 
 from api import settings
+from api.db.db_models import DB
 from api.db.services.ldap_service import LDAPConfigService, LDAPUserService
 from api.db.services.user_service import UserService
-from api.ldap.ldap_auth import LDAPAuthenticator
-from api.ldap.ldap_scheduler import force_ldap_sync
+from api.ldap.ldap_auth import LDAPConnectionManager, authenticator
+from api.ldap.ldap_scheduler import get_ldap_sync_job, submit_ldap_sync
 from api.utils import get_uuid, get_format_time, current_timestamp, decrypt
 from api.utils.api_utils import (
     construct_response,
@@ -32,6 +39,74 @@ from api.utils.api_utils import (
 )
 from datetime import datetime
 
+try:
+    import ldap3  # noqa: F401
+    from ldap3.core.exceptions import LDAPInvalidDnError
+    from ldap3.utils.dn import safe_dn
+    _LDAP3_AVAILABLE = True
+except ImportError:
+    _LDAP3_AVAILABLE = False
+
+# 连接测试的超时时间（秒）
+_TEST_CONNECTION_TIMEOUT = 5
+
+# 用户列表返回的字段
+_LDAP_USER_LIST_FIELDS = (
+    'id', 'ldap_config_id', 'user_id', 'ldap_dn', 'ldap_username', 'email', 'nickname',
+    'first_name', 'last_name', 'is_active', 'last_login_time', 'last_sync_time', 'sync_status'
+)
+
+# 管理端轮询的只读接口的短期响应缓存
+_status_cache = TTLCache(maxsize=256, ttl=15)
+_status_cache_lock = threading.Lock()
+
+
+def _invalidate_status_cache():
+    with _status_cache_lock:
+        _status_cache.clear()
+
+
+def _etag_json_result(data):
+    """返回带ETag的JSON结果，客户端缓存未过期时返回304"""
+    etag = hashlib.md5(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = get_json_result(data=data)
+    response.set_etag(etag)
+    return response
+
+
+def superuser_required(func):
+    """仅允许管理员访问"""
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_superuser:
+            return get_json_result(
+                data=False,
+                code=settings.RetCode.AUTHENTICATION_ERROR,
+                message="Admin access required!"
+            )
+        return func(*args, **kwargs)
+
+    return decorated_function
+
+
+def expect_json(func):
+    """解析一次请求体并保存到g.json"""
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        g.json = request.get_json(force=True, silent=True) or {}
+        return func(*args, **kwargs)
+
+    return decorated_function
+
+
+@manager.before_request  # noqa: F821
+def load_ldap_config():
+    """在请求开始时加载一次LDAP配置，供同一请求内复用"""
+    g.ldap_config = LDAPConfigService.get_active_config()
+
 
 @manager.route('/login', methods=['POST'])  # noqa: F821
 def ldap_login():
@@ -93,7 +168,6 @@ def ldap_login():
 
     try:
         # LDAP认证
-        authenticator = LDAPAuthenticator()
         success, ldap_user_info = authenticator.authenticate_user(username, password)
         
         if not success or not ldap_user_info:
@@ -104,7 +178,7 @@ def ldap_login():
             )
 
         # 获取或创建LDAP用户记录
-        config = LDAPConfigService.get_active_config()
+        config = g.ldap_config
         if not config:
             return get_json_result(
                 data=False,
@@ -129,8 +203,7 @@ def ldap_login():
         # 获取或创建系统用户
         system_user = None
         if ldap_user.user_id:
-            users = UserService.query(id=ldap_user.user_id)
-            system_user = users[0] if users else None
+            system_user = UserService.filter_by_id(ldap_user.user_id)
 
         if not system_user and config.auto_create_user:
             # 自动创建系统用户
@@ -182,6 +255,7 @@ def ldap_login():
 
 @manager.route('/config', methods=['GET'])  # noqa: F821
 @login_required
+@superuser_required
 def get_config():
     """
     获取LDAP配置
@@ -196,31 +270,22 @@ def get_config():
         schema:
           type: object
     """
-    try:
-        if not current_user.is_superuser:
-            return get_json_result(
-                data=False,
-                code=settings.RetCode.AUTHENTICATION_ERROR,
-                message="Admin access required!"
-            )
+    config = g.ldap_config
+    if not config:
+        return get_json_result(data=None, message="No LDAP configuration found")
 
-        config = LDAPConfigService.get_active_config()
-        if not config:
-            return get_json_result(data=None, message="No LDAP configuration found")
-
-        config_data = config.to_dict()
-        # 隐藏敏感信息
-        config_data.pop('bind_password', None)
-        
-        return get_json_result(data=config_data)
-
-    except Exception as e:
-        return server_error_response(e)
+    config_data = config.to_dict()
+    # 隐藏敏感信息
+    config_data.pop('bind_password', None)
+    
+    return _etag_json_result(config_data)
 
 
 @manager.route('/config', methods=['POST'])  # noqa: F821
 @login_required
+@superuser_required
 @validate_request("name", "server_host", "server_port", "search_base")
+@expect_json
 def create_or_update_config():
     """
     创建或更新LDAP配置
@@ -279,51 +344,51 @@ def create_or_update_config():
             sync_interval:
               type: integer
               description: 同步间隔（秒）
+            max_pool_size:
+              type: integer
+              description: LDAP连接池大小
     responses:
       200:
         description: 配置更新成功
         schema:
           type: object
     """
-    try:
-        if not current_user.is_superuser:
-            return get_json_result(
-                data=False,
-                code=settings.RetCode.AUTHENTICATION_ERROR,
-                message="Admin access required!"
-            )
+    req = g.json
+    
+    # 验证同步间隔
+    sync_interval = req.get('sync_interval', 30)
+    if sync_interval < 30:
+        return get_data_error_result(message="Sync interval must be at least 30 seconds")
 
-        req = request.json
-        
-        # 验证同步间隔
-        sync_interval = req.get('sync_interval', 30)
-        if sync_interval < 30:
-            return get_data_error_result(message="Sync interval must be at least 30 seconds")
+    # 保存时校验搜索基准DN，避免错误配置在每次搜索时才失败
+    if _LDAP3_AVAILABLE and req.get('search_base'):
+        try:
+            safe_dn(req['search_base'])
+        except LDAPInvalidDnError:
+            return get_data_error_result(message="Invalid search base DN")
 
-        # 获取现有配置
-        existing_config = LDAPConfigService.get_active_config()
-        
-        if existing_config:
-            # 更新现有配置
-            success = LDAPConfigService.update_config(existing_config.id, req)
-            if success:
-                return get_json_result(data=True, message="LDAP configuration updated successfully")
-            else:
-                return server_error_response("Failed to update LDAP configuration")
+    # 获取现有配置
+    existing_config = g.ldap_config
+    
+    if existing_config:
+        # 更新现有配置
+        success = LDAPConfigService.update_config(existing_config.id, req)
+        if success:
+            return get_json_result(data=True, message="LDAP configuration updated successfully")
         else:
-            # 创建新配置
-            config = LDAPConfigService.create_config(req)
-            if config:
-                return get_json_result(data=config.to_dict(), message="LDAP configuration created successfully")
-            else:
-                return server_error_response("Failed to create LDAP configuration")
-
-    except Exception as e:
-        return server_error_response(e)
+            return server_error_response("Failed to update LDAP configuration")
+    else:
+        # 创建新配置
+        config = LDAPConfigService.create_config(req)
+        if config:
+            return get_json_result(data=config.to_dict(), message="LDAP configuration created successfully")
+        else:
+            return server_error_response("Failed to create LDAP configuration")
 
 
 @manager.route('/config/test', methods=['POST'])  # noqa: F821
 @login_required
+@superuser_required
 def test_connection():
     """
     测试LDAP连接
@@ -338,43 +403,33 @@ def test_connection():
         schema:
           type: object
     """
-    try:
-        if not current_user.is_superuser:
-            return get_json_result(
-                data=False,
-                code=settings.RetCode.AUTHENTICATION_ERROR,
-                message="Admin access required!"
-            )
-
-        config = LDAPConfigService.get_active_config()
-        if not config:
-            return get_data_error_result(message="No LDAP configuration found")
-
-        # TODO: 实现LDAP连接测试
-        from api.ldap.ldap_auth import LDAPConnectionManager
-        
-        try:
-            conn_mgr = LDAPConnectionManager(config)
-            with conn_mgr:
-                return get_json_result(
-                    data=True,
-                    message="LDAP connection successful"
-                )
-        except Exception as e:
-            return get_json_result(
-                data=False,
-                message=f"LDAP connection failed: {str(e)}"
-            )
+    config = g.ldap_config
+    if not config:
+        return get_data_error_result(message="No LDAP configuration found")
 
+    # 使用独立连接并限制超时，避免LDAP服务无响应时长期占用工作线程
+    try:
+        conn_mgr = LDAPConnectionManager(config)
+        if not conn_mgr.connect(receive_timeout=_TEST_CONNECTION_TIMEOUT):
+            return get_json_result(data=False, message="LDAP connection failed")
+        conn_mgr.disconnect()
+        return get_json_result(
+            data=True,
+            message="LDAP connection successful"
+        )
     except Exception as e:
-        return server_error_response(e)
+        return get_json_result(
+            data=False,
+            message=f"LDAP connection failed: {str(e)}"
+        )
 
 
 @manager.route('/sync', methods=['POST'])  # noqa: F821
 @login_required
+@superuser_required
 def force_sync():
     """
-    强制执行用户同步
+    提交用户同步任务，立即返回任务ID
     ---
     tags:
       - LDAP
@@ -382,30 +437,61 @@ def force_sync():
       - ApiKeyAuth: []
     responses:
       200:
-        description: 同步执行结果
+        description: 同步任务已提交
         schema:
           type: object
     """
-    try:
-        if not current_user.is_superuser:
-            return get_json_result(
-                data=False,
-                code=settings.RetCode.AUTHENTICATION_ERROR,
-                message="Admin access required!"
-            )
+    job_id = submit_ldap_sync()
+    return get_json_result(data={'job_id': job_id, 'status': 'queued'}, message="LDAP sync queued")
 
-        success = force_ldap_sync()
-        if success:
-            return get_json_result(data=True, message="LDAP sync completed successfully")
-        else:
-            return get_json_result(data=False, message="LDAP sync failed")
 
-    except Exception as e:
-        return server_error_response(e)
+@manager.route('/sync/status/<job_id>', methods=['GET'])  # noqa: F821
+@login_required
+@superuser_required
+def get_sync_status(job_id):
+    """
+    获取同步任务状态
+    ---
+    tags:
+      - LDAP
+    security:
+      - ApiKeyAuth: []
+    parameters:
+      - in: path
+        name: job_id
+        type: string
+        required: true
+        description: 同步任务ID
+    responses:
+      200:
+        description: 同步任务状态
+        schema:
+          type: object
+    """
+    job = get_ldap_sync_job(job_id)
+    if job is None:
+        status = 'unknown'
+    elif job.running():
+        status = 'running'
+    elif not job.done():
+        status = 'queued'
+    elif job.exception() is None and job.result():
+        status = 'completed'
+    else:
+        status = 'failed'
+        
+    config = g.ldap_config
+    return get_json_result(data={
+        'job_id': job_id,
+        'status': status,
+        'sync_status': config.sync_status if config else 'idle',
+        'last_sync_time': config.last_sync_time.isoformat() if config and config.last_sync_time else None
+    })
 
 
 @manager.route('/users', methods=['GET'])  # noqa: F821
 @login_required
+@superuser_required
 def get_ldap_users():
     """
     获取LDAP用户列表
@@ -419,51 +505,118 @@ def get_ldap_users():
         name: active_only
         type: boolean
         description: 仅显示活跃用户
+      - in: query
+        name: page
+        type: integer
+        description: 页码，为0时返回全部用户
+      - in: query
+        name: page_size
+        type: integer
+        description: 每页数量
+      - in: query
+        name: keywords
+        type: string
+        description: 按用户名、邮箱、昵称过滤
+      - in: query
+        name: detail
+        type: boolean
+        description: 是否返回原始LDAP属性
     responses:
       200:
         description: 用户列表
         schema:
           type: object
     """
-    try:
-        if not current_user.is_superuser:
-            return get_json_result(
-                data=False,
-                code=settings.RetCode.AUTHENTICATION_ERROR,
-                message="Admin access required!"
+    config = g.ldap_config
+    if not config:
+        return get_data_error_result(message="No LDAP configuration found")
+
+    active_only = request.args.get('active_only', 'true').lower() == 'true'
+    page_number = int(request.args.get('page', 0))
+    items_per_page = int(request.args.get('page_size', 0))
+    keywords = request.args.get('keywords', '')
+    detail = request.args.get('detail', 'false').lower() == 'true'
+
+    # 列表只需要部分字段，原始属性仅在detail=true时返回
+    cols = [getattr(LDAPUserService.model, name) for name in _LDAP_USER_LIST_FIELDS]
+    if detail:
+        cols.append(LDAPUserService.model.ldap_attributes)
+    # 查询在首次迭代时执行，结果缓存在查询对象上，后续遍历不会重复查询；
+    # 首次迭代需在连接上下文内完成，以便连接用完即归还连接池
+    with DB.connection_context():
+        users = LDAPUserService.get_users_by_config(
+            config.id, active_only, page_number, items_per_page, keywords, cols
+        )
+        user_ids = [user.user_id for user in users if user.user_id]
+
+    # 一次查询获取所有关联的系统用户信息
+    system_users = {}
+    if user_ids:
+        model = UserService.model
+        system_users = {
+            system_user.id: system_user
+            for system_user in UserService.get_by_ids(
+                user_ids, cols=[model.id, model.email, model.nickname, model.status]
             )
+        }
 
-        config = LDAPConfigService.get_active_config()
-        if not config:
-            return get_data_error_result(message="No LDAP configuration found")
+    user_list = []
+    for user in users:
+        user_data = {name: getattr(user, name) for name in _LDAP_USER_LIST_FIELDS}
+        if detail:
+            user_data['ldap_attributes'] = user.ldap_attributes
+        system_user = system_users.get(user.user_id)
+        if system_user:
+            user_data['system_user'] = {
+                'id': system_user.id,
+                'email': system_user.email,
+                'nickname': system_user.nickname,
+                'status': system_user.status
+            }
+        user_list.append(user_data)
 
-        active_only = request.args.get('active_only', 'true').lower() == 'true'
-        users = LDAPUserService.get_users_by_config(config.id, active_only)
-        
-        user_list = []
-        for user in users:
-            user_data = user.to_dict()
-            # 获取关联的系统用户信息
-            if user.user_id:
-                system_users = UserService.query(id=user.user_id)
-                if system_users:
-                    system_user = system_users[0]
-                    user_data['system_user'] = {
-                        'id': system_user.id,
-                        'email': system_user.email,
-                        'nickname': system_user.nickname,
-                        'status': system_user.status
-                    }
-            user_list.append(user_data)
-
-        return get_json_result(data=user_list)
+    if page_number and items_per_page:
+        total = LDAPUserService.count_users_by_config(config.id, active_only, keywords)
+        return get_json_result(data={'users': user_list, 'total': total})
+    return get_json_result(data=user_list)
 
-    except Exception as e:
-        return server_error_response(e)
+
+@manager.route('/users/<user_id>', methods=['GET'])  # noqa: F821
+@login_required
+@superuser_required
+def get_ldap_user(user_id):
+    """
+    获取LDAP用户详情（包含原始LDAP属性）
+    ---
+    tags:
+      - LDAP
+    security:
+      - ApiKeyAuth: []
+    parameters:
+      - in: path
+        name: user_id
+        type: string
+        required: true
+        description: LDAP用户ID
+    responses:
+      200:
+        description: 用户详情
+        schema:
+          type: object
+    """
+    exists, user = LDAPUserService.get_by_id(user_id)
+    if not exists:
+        return get_data_error_result(message="LDAP user not found")
+
+    user_data = {name: getattr(user, name) for name in _LDAP_USER_LIST_FIELDS}
+    user_data['ldap_attributes'] = user.ldap_attributes
+    return get_json_result(data=user_data)
 
 
 @manager.route('/users/<user_id>/status', methods=['PUT'])  # noqa: F821
 @login_required
+@superuser_required
+@expect_json
 def update_user_status(user_id):
     """
     更新LDAP用户状态
@@ -494,29 +647,20 @@ def update_user_status(user_id):
         schema:
           type: object
     """
-    try:
-        if not current_user.is_superuser:
-            return get_json_result(
-                data=False,
-                code=settings.RetCode.AUTHENTICATION_ERROR,
-                message="Admin access required!"
-            )
-
-        req = request.json
-        is_active = req.get('is_active', True)
-        
-        success = LDAPUserService.set_user_status(user_id, is_active)
-        if success:
-            return get_json_result(data=True, message="User status updated successfully")
-        else:
-            return get_data_error_result(message="Failed to update user status")
-
-    except Exception as e:
-        return server_error_response(e)
+    req = g.json
+    is_active = req.get('is_active', True)
+    
+    success = LDAPUserService.set_user_status(user_id, is_active)
+    if success:
+        _invalidate_status_cache()
+        return get_json_result(data=True, message="User status updated successfully")
+    else:
+        return get_data_error_result(message="Failed to update user status")
 
 
 @manager.route('/status', methods=['GET'])  # noqa: F821
 @login_required
+@superuser_required
 def get_ldap_status():
     """
     获取LDAP服务状态
@@ -531,45 +675,33 @@ def get_ldap_status():
         schema:
           type: object
     """
-    try:
-        if not current_user.is_superuser:
-            return get_json_result(
-                data=False,
-                code=settings.RetCode.AUTHENTICATION_ERROR,
-                message="Admin access required!"
-            )
-
-        config = LDAPConfigService.get_active_config()
-        
-        status_data = {
-            'configured': config is not None,
-            'enabled': config.enabled if config else False,
-            'sync_enabled': config.sync_enabled if config else False,
-            'sync_interval': config.sync_interval if config else 30,
-            'last_sync_time': config.last_sync_time.isoformat() if config and config.last_sync_time else None,
-            'sync_status': config.sync_status if config else 'idle',
-            'ldap3_available': True
+    config = g.ldap_config
+    # 配置变更（包括同步状态更新）会改变update_time，从而自动失效
+    cache_key = (current_user.id, config.id if config else None, config.update_time if config else None)
+    with _status_cache_lock:
+        status_data = _status_cache.get(cache_key)
+    if status_data is not None:
+        return _etag_json_result(status_data)
+    
+    status_data = {
+        'configured': config is not None,
+        'enabled': config.enabled if config else False,
+        'sync_enabled': config.sync_enabled if config else False,
+        'sync_interval': config.sync_interval if config else 30,
+        'last_sync_time': config.last_sync_time.isoformat() if config and config.last_sync_time else None,
+        'sync_status': config.sync_status if config else 'idle',
+        'ldap3_available': _LDAP3_AVAILABLE
+    }
+
+    # 获取用户统计
+    if config:
+        counts = LDAPUserService.count_by_status(config.id)
+        status_data['user_stats'] = {
+            'total_users': counts['total'],
+            'active_users': counts['active'],
+            'inactive_users': counts['inactive']
         }
-        
-        # 检查ldap3库是否可用
-        try:
-            import ldap3
-            status_data['ldap3_available'] = True
-        except ImportError:
-            status_data['ldap3_available'] = False
 
-        # 获取用户统计
-        if config:
-            all_users = LDAPUserService.get_users_by_config(config.id, active_only=False)
-            active_users = LDAPUserService.get_users_by_config(config.id, active_only=True)
-            
-            status_data['user_stats'] = {
-                'total_users': len(all_users),
-                'active_users': len(active_users),
-                'inactive_users': len(all_users) - len(active_users)
-            }
-
-        return get_json_result(data=status_data)
-
-    except Exception as e:
-        return server_error_response(e)
\ No newline at end of file
+    with _status_cache_lock:
+        _status_cache[cache_key] = status_data
+    return _etag_json_result(status_data)
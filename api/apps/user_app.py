@@ -99,12 +99,11 @@ def login():
 
     # Try LDAP authentication first
     try:
-        from api.ldap.ldap_auth import LDAPAuthenticator
+        from api.ldap.ldap_auth import authenticator
         from api.db.services.ldap_service import LDAPConfigService, LDAPUserService
         
         config = LDAPConfigService.get_active_config()
         if config and config.enabled:
-            authenticator = LDAPAuthenticator()
             ldap_success, ldap_user_info = authenticator.authenticate_user(email, password)
             
             if ldap_success and ldap_user_info:
@@ -119,8 +118,7 @@ def login():
                     # Get or create system user
                     system_user = None
                     if ldap_user.user_id:
-                        system_users = UserService.query(id=ldap_user.user_id)
-                        system_user = system_users[0] if system_users else None
+                        system_user = UserService.filter_by_id(ldap_user.user_id)
                     
                     if not system_user and config.auto_create_user:
                         # Auto-create system user
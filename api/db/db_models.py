@@ -548,6 +548,7 @@ class LDAPConfig(DataBaseModel):
     auto_create_user = BooleanField(null=False, default=True, help_text="Auto create user if not exists")
     sync_enabled = BooleanField(null=False, default=True, help_text="Enable user synchronization")
     sync_interval = IntegerField(null=False, default=30, help_text="Sync interval in seconds")
+    max_pool_size = IntegerField(null=False, default=8, help_text="Max pooled LDAP connections")
     last_sync_time = DateTimeField(null=True, help_text="Last synchronization time", index=True)
     sync_status = CharField(max_length=50, null=True, default="idle", help_text="Synchronization status", index=True)
     
@@ -573,6 +574,13 @@ class LDAPUser(DataBaseModel):
     
     class Meta:
         db_table = "ldap_user"
+        indexes = (
+            (("ldap_config_id", "ldap_dn"), True),
+            (("ldap_config_id", "ldap_username"), False),
+            (("ldap_config_id", "email"), False),
+            (("ldap_config_id", "is_active"), False),
+            (("ldap_config_id", "sync_status", "update_date"), False),
+        )
 
 
 class Tenant(DataBaseModel):
@@ -1088,5 +1096,29 @@ def migrate_db():
         LDAPUser.create_table()
     except Exception:
         pass
+    try:
+        migrate(migrator.add_column("ldap_config", "max_pool_size", IntegerField(null=False, default=8, help_text="Max pooled LDAP connections")))
+    except Exception:
+        pass
+    try:
+        migrate(migrator.add_index("ldap_user", ("ldap_config_id", "ldap_dn"), True))
+    except Exception:
+        pass
+    try:
+        migrate(migrator.add_index("ldap_user", ("ldap_config_id", "ldap_username"), False))
+    except Exception:
+        pass
+    try:
+        migrate(migrator.add_index("ldap_user", ("ldap_config_id", "email"), False))
+    except Exception:
+        pass
+    try:
+        migrate(migrator.add_index("ldap_user", ("ldap_config_id", "is_active"), False))
+    except Exception:
+        pass
+    try:
+        migrate(migrator.add_index("ldap_user", ("ldap_config_id", "sync_status", "update_date"), False))
+    except Exception:
+        pass
         
     logging.disable(logging.NOTSET)
@@ -14,43 +14,99 @@
 #  limitations under the License.
 #
 import logging
+import threading
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 
+from cachetools import TTLCache
+from peewee import SQL, Case, fn
+from playhouse.pool import PooledMySQLDatabase
+
 from api.db.db_models import DB, LDAPConfig, LDAPUser
 from api.db.services.common_service import CommonService
 from api.utils import get_uuid, current_timestamp, datetime_format
 
 
+ACTIVE_CONFIG_CACHE_TTL = 30
+UPSERT_BATCH_SIZE = 500
+STALE_DN_INLINE_LIMIT = 1000
+_ACTIVE_DN_TABLE = "tmp_ldap_active_dn"
+
+# (model, field name) -> (sql, constant trailing params) for single-row user lookups
+_lookup_sql_cache: Dict[Tuple, Tuple[str, Tuple]] = {}
+
+_active_config_cache = TTLCache(maxsize=4, ttl=ACTIVE_CONFIG_CACHE_TTL)
+_active_config_lock = threading.Lock()
+
+
 class LDAPConfigService(CommonService):
     """Service class for managing LDAP configuration operations."""
     model = LDAPConfig
 
     @classmethod
-    @DB.connection_context()
-    def get_active_config(cls) -> Optional[LDAPConfig]:
-        """Get the first active LDAP configuration."""
+    def get_active_config(cls, cols=None) -> Optional[LDAPConfig]:
+        """Get the first active LDAP configuration, cached in-process for a short TTL.
+
+        Passing `cols` selects only those columns; such partial rows bypass the cache.
+        """
+        if cols:
+            try:
+                return cls._query_active_config(cols)
+            except Exception as e:
+                logging.exception(f"Failed to get active LDAP config: {e}")
+                return None
+
+        with _active_config_lock:
+            if "active" in _active_config_cache:
+                return _active_config_cache["active"]
+
         try:
-            return cls.model.select().where(cls.model.enabled == True).first()
+            config = cls._query_active_config()
         except Exception as e:
             logging.exception(f"Failed to get active LDAP config: {e}")
             return None
 
+        with _active_config_lock:
+            _active_config_cache["active"] = config
+        return config
+
+    @classmethod
+    @DB.connection_context()
+    def _query_active_config(cls, cols=None) -> Optional[LDAPConfig]:
+        query = cls.model.select(*cols) if cols else cls.model.select()
+        return query.where(cls.model.enabled == True).first()
+
+    @classmethod
+    def invalidate_active_config(cls):
+        """Drop the cached active configuration, and the login DNs found with its search settings, after a write."""
+        cls._drop_cached_config()
+        # Imported here because ldap_auth depends on this module
+        from api.ldap.ldap_auth import clear_user_dn_cache
+        clear_user_dn_cache()
+
+    @classmethod
+    def _drop_cached_config(cls):
+        with _active_config_lock:
+            _active_config_cache.clear()
+
     @classmethod
     @DB.connection_context()
     def create_config(cls, config_data: Dict) -> Optional[LDAPConfig]:
         """Create a new LDAP configuration."""
         try:
             config_id = get_uuid()
+            now = datetime.now()
+            timestamp = current_timestamp()
             config_data.update({
                 'id': config_id,
-                'create_time': current_timestamp(),
-                'create_date': datetime.now(),
-                'update_time': current_timestamp(),
-                'update_date': datetime.now()
+                'create_time': timestamp,
+                'create_date': now,
+                'update_time': timestamp,
+                'update_date': now
             })
             
             config = cls.model.create(**config_data)
+            cls.invalidate_active_config()
             return config
         except Exception as e:
             logging.exception(f"Failed to create LDAP config: {e}")
@@ -69,6 +125,7 @@ class LDAPConfigService(CommonService):
             updated_rows = cls.model.update(**config_data).where(
                 cls.model.id == config_id
             ).execute()
+            cls.invalidate_active_config()
             return updated_rows > 0
         except Exception as e:
             logging.exception(f"Failed to update LDAP config {config_id}: {e}")
@@ -91,6 +148,8 @@ class LDAPConfigService(CommonService):
             updated_rows = cls.model.update(**update_data).where(
                 cls.model.id == config_id
             ).execute()
+            # Only the sync fields changed, so the cached login DNs stay valid
+            cls._drop_cached_config()
             return updated_rows > 0
         except Exception as e:
             logging.exception(f"Failed to update sync status for config {config_id}: {e}")
@@ -101,12 +160,41 @@ class LDAPUserService(CommonService):
     """Service class for managing LDAP user operations."""
     model = LDAPUser
 
+    @classmethod
+    def _get_by_field(cls, config_id: str, field_name: str, value) -> Optional[LDAPUser]:
+        """Fetch one user of a configuration by `field_name`.
+
+        The SQL of these fixed-shape lookups is generated once and reused through a raw
+        query, so the login and sync paths skip peewee's per-call query building.
+        """
+        field = getattr(cls.model, field_name)
+        if value is None:
+            # peewee compiles `== None` to an IS comparison, which must not be cached for other values
+            return cls.model.select().where(
+                (cls.model.ldap_config_id == config_id) & field.is_null()
+            ).first()
+        key = (cls.model, field_name)
+        compiled = _lookup_sql_cache.get(key)
+        if compiled is None:
+            # Compile from placeholder values so the SQL never depends on the first caller's arguments
+            sql, params = cls.model.select().where(
+                (cls.model.ldap_config_id == '') & (field == '')
+            ).limit(1).sql()
+            # The first two parameters are the lookup values; the rest (LIMIT) are constant
+            compiled = _lookup_sql_cache[key] = (sql, tuple(params[2:]))
+        sql, extra_params = compiled
+        for user in cls.model.raw(sql, config_id, value, *extra_params):
+            return user
+        return None
+
     @classmethod
     @DB.connection_context()
-    def get_by_ldap_username(cls, config_id: str, username: str) -> Optional[LDAPUser]:
+    def get_by_ldap_username(cls, config_id: str, username: str, cols=None) -> Optional[LDAPUser]:
         """Get LDAP user by username."""
         try:
-            return cls.model.select().where(
+            if not cols:
+                return cls._get_by_field(config_id, 'ldap_username', username)
+            return cls.model.select(*cols).where(
                 (cls.model.ldap_config_id == config_id) &
                 (cls.model.ldap_username == username)
             ).first()
@@ -116,10 +204,12 @@ class LDAPUserService(CommonService):
 
     @classmethod
     @DB.connection_context()
-    def get_by_dn(cls, config_id: str, dn: str) -> Optional[LDAPUser]:
+    def get_by_dn(cls, config_id: str, dn: str, cols=None) -> Optional[LDAPUser]:
         """Get LDAP user by DN."""
         try:
-            return cls.model.select().where(
+            if not cols:
+                return cls._get_by_field(config_id, 'ldap_dn', dn)
+            return cls.model.select(*cols).where(
                 (cls.model.ldap_config_id == config_id) &
                 (cls.model.ldap_dn == dn)
             ).first()
@@ -129,10 +219,12 @@ class LDAPUserService(CommonService):
 
     @classmethod
     @DB.connection_context()
-    def get_by_email(cls, config_id: str, email: str) -> Optional[LDAPUser]:
+    def get_by_email(cls, config_id: str, email: str, cols=None) -> Optional[LDAPUser]:
         """Get LDAP user by email."""
         try:
-            return cls.model.select().where(
+            if not cols:
+                return cls._get_by_field(config_id, 'email', email)
+            return cls.model.select(*cols).where(
                 (cls.model.ldap_config_id == config_id) &
                 (cls.model.email == email)
             ).first()
@@ -145,16 +237,17 @@ class LDAPUserService(CommonService):
     def create_or_update_user(cls, config_id: str, ldap_data: Dict) -> Tuple[Optional[LDAPUser], bool]:
         """Create or update LDAP user. Returns (user, created)."""
         try:
-            # Check if user already exists
+            # Check if user already exists, matching on the most specific key available
             existing_user = None
             if 'dn' in ldap_data:
-                existing_user = cls.get_by_dn(config_id, ldap_data['dn'])
+                existing_user = cls._get_by_field(config_id, 'ldap_dn', ldap_data['dn'])
             elif 'username' in ldap_data:
-                existing_user = cls.get_by_ldap_username(config_id, ldap_data['username'])
+                existing_user = cls._get_by_field(config_id, 'ldap_username', ldap_data['username'])
             elif 'email' in ldap_data:
-                existing_user = cls.get_by_email(config_id, ldap_data['email'])
+                existing_user = cls._get_by_field(config_id, 'email', ldap_data['email'])
 
             now = datetime.now()
+            timestamp = current_timestamp()
             
             if existing_user:
                 # Update existing user
@@ -167,7 +260,7 @@ class LDAPUserService(CommonService):
                     'is_active': ldap_data.get('is_active', True),
                     'last_sync_time': now,
                     'sync_status': 'synced',
-                    'update_time': current_timestamp(),
+                    'update_time': timestamp,
                     'update_date': now
                 }
                 
@@ -175,8 +268,9 @@ class LDAPUserService(CommonService):
                     cls.model.id == existing_user.id
                 ).execute()
                 
-                # Refresh the model instance
-                existing_user = cls.get_by_id(existing_user.id)
+                # Apply the update to the loaded instance instead of re-reading the row
+                for field, value in update_data.items():
+                    setattr(existing_user, field, value)
                 return existing_user, False
             else:
                 # Create new user
@@ -194,9 +288,9 @@ class LDAPUserService(CommonService):
                     'is_active': ldap_data.get('is_active', True),
                     'last_sync_time': now,
                     'sync_status': 'synced',
-                    'create_time': current_timestamp(),
+                    'create_time': timestamp,
                     'create_date': now,
-                    'update_time': current_timestamp(),
+                    'update_time': timestamp,
                     'update_date': now
                 }
                 
@@ -207,18 +301,146 @@ class LDAPUserService(CommonService):
             logging.exception(f"Failed to create/update LDAP user: {e}")
             return None, False
 
+    @classmethod
+    def bulk_upsert(cls, config_id: str, ldap_records: List[Dict]) -> Tuple[List[LDAPUser], int]:
+        """Create or update a batch of LDAP users keyed by DN. Returns (created users, updated count).
+
+        Database errors are raised so callers never act on a partially written batch. Like the
+        other sync writes below, this runs on the caller's connection: call it inside
+        `DB.connection_context()`, whose close would otherwise fail within the sync transaction.
+        """
+        # The last record wins when the directory returns the same DN twice
+        records = list({record['dn']: record for record in ldap_records if record.get('dn')}.values())
+        preserve = [
+            cls.model.email, cls.model.nickname, cls.model.first_name, cls.model.last_name,
+            cls.model.ldap_attributes, cls.model.is_active, cls.model.last_sync_time,
+            cls.model.sync_status, cls.model.update_time, cls.model.update_date
+        ]
+        created_users = []
+        updated = 0
+        now = datetime.now()
+        timestamp = current_timestamp()
+
+        with DB.atomic():
+            for i in range(0, len(records), UPSERT_BATCH_SIZE):
+                chunk = records[i:i + UPSERT_BATCH_SIZE]
+                existing = {
+                    dn: user_id for user_id, dn in cls.model.select(cls.model.id, cls.model.ldap_dn).where(
+                        (cls.model.ldap_config_id == config_id) &
+                        (cls.model.ldap_dn.in_([record['dn'] for record in chunk]))
+                    ).tuples()
+                }
+
+                rows = []
+                for record in chunk:
+                    row = {
+                        'id': existing.get(record['dn']) or get_uuid(),
+                        'ldap_config_id': config_id,
+                        'ldap_dn': record['dn'],
+                        'ldap_username': record.get('username') or '',
+                        'email': record.get('email'),
+                        'nickname': record.get('nickname'),
+                        'first_name': record.get('first_name'),
+                        'last_name': record.get('last_name'),
+                        'ldap_attributes': record.get('attributes', {}),
+                        'is_active': record.get('is_active', True),
+                        'last_sync_time': now,
+                        'sync_status': 'synced',
+                        'create_time': timestamp,
+                        'create_date': now,
+                        'update_time': timestamp,
+                        'update_date': now
+                    }
+                    rows.append(row)
+                    if record['dn'] in existing:
+                        updated += 1
+                    else:
+                        created_users.append(cls.model(**row))
+
+                query = cls.model.insert_many(rows)
+                if isinstance(DB, PooledMySQLDatabase):
+                    query = query.on_conflict(preserve=preserve)
+                else:
+                    query = query.on_conflict(
+                        conflict_target=[cls.model.ldap_config_id, cls.model.ldap_dn],
+                        preserve=preserve
+                    )
+                query.execute()
+
+        return created_users, updated
+
+    @classmethod
+    def get_users_by_config(cls, config_id: str, active_only: bool = True, page_number: int = 0,
+                            items_per_page: int = 0, keywords: str = "", cols=None):
+        """Build the query for LDAP users of a configuration, optionally filtered, paginated and
+        projected to `cols`.
+
+        The query is returned unevaluated so callers can iterate it (rows are fetched on first
+        iteration and cached on the query) or call `.count()` without loading every user.
+        Evaluate it inside `DB.connection_context()`, so the pooled connection is returned as
+        soon as the rows are read.
+        """
+        query = cls._users_query(config_id, active_only, keywords, cols)
+        if page_number and items_per_page:
+            query = query.order_by(cls.model.ldap_username).paginate(page_number, items_per_page)
+        return query
+
     @classmethod
     @DB.connection_context()
-    def get_users_by_config(cls, config_id: str, active_only: bool = True) -> List[LDAPUser]:
-        """Get all LDAP users for a configuration."""
+    def count_users_by_config(cls, config_id: str, active_only: bool = True, keywords: str = "") -> int:
+        """Count LDAP users matching the same filters as get_users_by_config."""
         try:
-            query = cls.model.select().where(cls.model.ldap_config_id == config_id)
-            if active_only:
-                query = query.where(cls.model.is_active == True)
-            return list(query)
+            return cls._users_query(config_id, active_only, keywords).count()
         except Exception as e:
-            logging.exception(f"Failed to get LDAP users for config {config_id}: {e}")
-            return []
+            logging.exception(f"Failed to count LDAP users for config {config_id}: {e}")
+            return 0
+
+    @classmethod
+    def _users_query(cls, config_id: str, active_only: bool, keywords: str = "", cols=None):
+        query = cls.model.select(*cols) if cols else cls.model.select()
+        query = query.where(cls.model.ldap_config_id == config_id)
+        if active_only:
+            query = query.where(cls.model.is_active == True)
+        if keywords:
+            keywords = keywords.lower()
+            query = query.where(
+                fn.LOWER(cls.model.ldap_username).contains(keywords) |
+                fn.LOWER(cls.model.email).contains(keywords) |
+                fn.LOWER(cls.model.nickname).contains(keywords)
+            )
+        return query
+
+    @classmethod
+    @DB.connection_context()
+    def count_by_status(cls, config_id: str) -> Dict[str, int]:
+        """Count active and inactive LDAP users of a configuration in one query."""
+        counts = {'active': 0, 'inactive': 0, 'total': 0}
+        try:
+            rows = cls.model.select(
+                cls.model.is_active, fn.COUNT(cls.model.id).alias('c')
+            ).where(
+                cls.model.ldap_config_id == config_id
+            ).group_by(cls.model.is_active).tuples()
+            for is_active, count in rows:
+                counts['active' if is_active else 'inactive'] += count
+            counts['total'] = counts['active'] + counts['inactive']
+        except Exception as e:
+            logging.exception(f"Failed to count LDAP users for config {config_id}: {e}")
+        return counts
+
+    @classmethod
+    def link_system_users(cls, links: Dict[str, str]) -> int:
+        """Set the system user of many LDAP users in one UPDATE. `links` maps LDAP user id -> system user id.
+
+        Database errors are raised and the caller's connection is used, as in bulk_upsert.
+        """
+        if not links:
+            return 0
+        return cls.model.update(
+            user_id=Case(cls.model.id, list(links.items())),
+            update_time=current_timestamp(),
+            update_date=datetime.now()
+        ).where(cls.model.id.in_(list(links))).execute()
 
     @classmethod
     @DB.connection_context()
@@ -252,21 +474,39 @@ class LDAPUserService(CommonService):
             return False
 
     @classmethod
-    @DB.connection_context()
     def mark_stale_users(cls, config_id: str, active_dns: List[str]) -> int:
-        """Mark users as inactive if they are not in the active DN list."""
+        """Mark users as inactive if they are not in the active DN list. Uses the caller's connection, as in bulk_upsert."""
         try:
-            updated_rows = cls.model.update(
+            update = cls.model.update(
                 is_active=False,
                 sync_status='stale',
                 update_time=current_timestamp(),
                 update_date=datetime.now()
-            ).where(
-                (cls.model.ldap_config_id == config_id) &
-                (cls.model.ldap_dn.not_in(active_dns)) &
-                (cls.model.is_active == True)
-            ).execute()
-            return updated_rows
+            )
+            scope = (cls.model.ldap_config_id == config_id) & (cls.model.is_active == True)
+
+            active_dns = list(set(active_dns))
+            if len(active_dns) <= STALE_DN_INLINE_LIMIT:
+                return update.where(scope & (cls.model.ldap_dn.not_in(active_dns))).execute()
+
+            # Large directories: a parameter list this long is rejected or planned badly, so
+            # load the DNs into a temporary table in chunks and anti-join against it
+            with DB.atomic():
+                DB.execute_sql(f"CREATE TEMPORARY TABLE {_ACTIVE_DN_TABLE} (dn VARCHAR(512) PRIMARY KEY)")
+                try:
+                    for i in range(0, len(active_dns), STALE_DN_INLINE_LIMIT):
+                        chunk = active_dns[i:i + STALE_DN_INLINE_LIMIT]
+                        DB.execute_sql(
+                            f"INSERT INTO {_ACTIVE_DN_TABLE} (dn) VALUES " + ",".join(["(%s)"] * len(chunk)),
+                            chunk
+                        )
+                    return update.where(
+                        scope & (cls.model.ldap_dn.not_in(SQL(f"(SELECT dn FROM {_ACTIVE_DN_TABLE})")))
+                    ).execute()
+                finally:
+                    # A plain DROP TABLE would implicitly commit on MySQL
+                    drop = "DROP TEMPORARY TABLE" if isinstance(DB, PooledMySQLDatabase) else "DROP TABLE"
+                    DB.execute_sql(f"{drop} IF EXISTS {_ACTIVE_DN_TABLE}")
         except Exception as e:
             logging.exception(f"Failed to mark stale users for config {config_id}: {e}")
             return 0
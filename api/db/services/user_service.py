@@ -103,6 +103,11 @@ class UserService(CommonService):
     @classmethod
     @DB.connection_context()
     def save(cls, **kwargs):
+        return cls._save(**kwargs)
+
+    @classmethod
+    def _save(cls, **kwargs):
+        """Insert a user on the caller's connection, for use inside an open transaction."""
         if "id" not in kwargs:
             kwargs["id"] = get_uuid()
         if "password" in kwargs:
@@ -27,15 +27,20 @@ RAGFlow LDAP模块
 __version__ = "1.0.0"
 __author__ = "RAGFlow Team"
 
-from .ldap_auth import LDAPAuthenticator, LDAPSyncService, LDAPConnectionManager
-from .ldap_scheduler import LDAPScheduler, start_ldap_scheduler, stop_ldap_scheduler, force_ldap_sync
+from .ldap_auth import LDAPAuthenticator, LDAPSyncService, LDAPConnectionManager, LDAPConnectionPool, authenticator, sync_service
+from .ldap_scheduler import LDAPScheduler, start_ldap_scheduler, stop_ldap_scheduler, force_ldap_sync, submit_ldap_sync, get_ldap_sync_job
 
 __all__ = [
     'LDAPAuthenticator',
     'LDAPSyncService', 
     'LDAPConnectionManager',
+    'LDAPConnectionPool',
+    'authenticator',
+    'sync_service',
     'LDAPScheduler',
     'start_ldap_scheduler',
     'stop_ldap_scheduler',
-    'force_ldap_sync'
+    'force_ldap_sync',
+    'submit_ldap_sync',
+    'get_ldap_sync_job'
 ]
\ No newline at end of file
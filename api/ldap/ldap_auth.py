@@ -13,24 +13,364 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import hashlib
 import logging
+import os
+import queue
 import ssl
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple, Any
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple, Any
+
+from cachetools import TTLCache
 
 try:
     import ldap3
-    from ldap3 import Server, Connection, ALL, NTLM, SIMPLE
-    from ldap3.core.exceptions import LDAPException, LDAPInvalidCredentialsError
+    from ldap3 import Connection, NONE, SIMPLE, SYNC
+    from ldap3.core.exceptions import LDAPException, LDAPBindError, LDAPInvalidCredentialsResult
+    from ldap3.utils.conv import escape_filter_chars
+    from ldap3.utils.dn import escape_rdn
 except ImportError:
     ldap3 = None
     logging.warning("ldap3 library not installed. LDAP functionality will be disabled.")
 
-from api.db.services.ldap_service import LDAPConfigService, LDAPUserService
+from api.db.db_models import DB
+from api.db.services.ldap_service import LDAPConfigService, LDAPUserService, UPSERT_BATCH_SIZE
 from api.db.services.user_service import UserService
 from api.utils import get_uuid, get_format_time
 
 
+DEFAULT_POOL_SIZE = 8
+LDAP_CONNECT_TIMEOUT = 5
+LDAP_RECEIVE_TIMEOUT = 10
+LDAP_POOL_ACQUIRE_TIMEOUT = 10
+# Pooled connections older than this are closed on release and reopened on demand
+LDAP_POOL_LIFETIME = 600
+# How long an unreachable server is skipped before it is tried again
+LDAP_SERVER_EXHAUST_TIME = 30
+# Entries requested per page by the sync search (simple paged results control)
+LDAP_SYNC_PAGE_SIZE = 1000
+# Between full rescans (which also detect removed users) only entries changed since the
+# previous sync are fetched; the overlap absorbs clock skew between this host and the server
+LDAP_FULL_SYNC_INTERVAL = timedelta(hours=24)
+LDAP_INCREMENTAL_OVERLAP = timedelta(minutes=5)
+
+# config id -> state of the last successful sync, used to decide between full and incremental
+_sync_state: Dict[str, Dict] = {}
+
+# (config id, search base, search filter, username) -> user DN, so repeat logins skip the
+# subtree search; cleared whenever the configuration is written
+_user_dn_cache = TTLCache(maxsize=10000, ttl=3600)
+_user_dn_cache_lock = threading.Lock()
+
+
+def clear_user_dn_cache():
+    """Forget all cached login DNs."""
+    with _user_dn_cache_lock:
+        _user_dn_cache.clear()
+
+# Recently rejected (config id, username, password) digests; repeats are refused without a bind.
+# The digest is keyed with a per-process secret so the cache never holds recoverable passwords.
+_failed_logins = TTLCache(maxsize=100000, ttl=60)
+_failed_logins_lock = threading.Lock()
+_FAILED_LOGIN_DIGEST_KEY = os.urandom(16)
+
+
+def _login_attempt_digest(config_id: str, username: str, password: str) -> bytes:
+    return hashlib.blake2b(
+        f"{config_id}\0{username}\0{password}".encode(),
+        key=_FAILED_LOGIN_DIGEST_KEY,
+        digest_size=16
+    ).digest()
+
+
+_USER_FIELD_DEFAULTS = (
+    ('username', 'uid'),
+    ('email', 'mail'),
+    ('nickname', 'displayName'),
+    ('first_name', 'givenName'),
+    ('last_name', 'sn'),
+)
+
+
+@lru_cache(maxsize=16)
+def _compile_attr_mapping(mapping_items: Tuple[Tuple[str, str], ...]) -> Tuple[Tuple[Tuple[str, str], ...], Tuple[str, ...]]:
+    """
+    Resolve an attribute mapping once.
+
+    Returns ((user field, lower-cased LDAP attribute), ...) for the user fields, falling back to
+    the default attribute of unmapped fields, and the attributes to request for user entries:
+    every mapped attribute plus cn, each once. The DN is always returned with the entry.
+    """
+    attr_mapping = dict(mapping_items)
+    resolved = [(field, attr_mapping.get(field, default_attr)) for field, default_attr in _USER_FIELD_DEFAULTS]
+    attrs = dict.fromkeys(attr for _, attr in resolved)
+    attrs.update(dict.fromkeys(attr_mapping.values()))
+    attrs.setdefault('cn')
+    attrs.pop('dn', None)
+    return tuple((field, attr.lower()) for field, attr in resolved), tuple(attrs)
+
+
+def _field_attrs(attr_mapping: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return _compile_attr_mapping(tuple(sorted(attr_mapping.items())))[0]
+
+
+def _search_attributes(attr_mapping: Dict[str, str]) -> List[str]:
+    return list(_compile_attr_mapping(tuple(sorted(attr_mapping.items())))[1])
+
+
+@lru_cache(maxsize=16)
+def _user_filter_template(search_filter: str, username_attr: str) -> str:
+    """
+    Turn a configured search filter into a template with a single `{username}` field.
+
+    The filter may use `{}` or `{username}` as the placeholder; without one, the user is
+    matched on the mapped username attribute.
+    """
+    if '{}' in search_filter:
+        return search_filter.replace('{}', '{username}')
+    if '{username}' in search_filter:
+        return search_filter
+    # Default search filter
+    return f"({username_attr}={{username}})"
+
+
+def normalize_ldap_entry(dn: str, attributes: Mapping[str, Any], attr_mapping: Dict[str, str]) -> Dict:
+    """
+    Translate the attributes of one LDAP search result into the user dict consumed by
+    LDAPUserService.
+
+    Multi-valued attributes keep their first value and single values are converted to str.
+    Attribute names are matched case-insensitively, as LDAP does. ldap3 returns the attributes
+    as a CaseInsensitiveDict, so any mapping is accepted.
+    """
+    return _normalize_entry(dn, attributes, _field_attrs(attr_mapping))
+
+
+def _normalize_entry(dn: str, attributes: Mapping[str, Any], field_attrs: Tuple[Tuple[str, str], ...]) -> Dict:
+    """normalize_ldap_entry with the mapping already resolved by _field_attrs, for per-entry loops."""
+    values = {}
+    lookup = {}
+    for name, value in attributes.items():
+        if not value:
+            value = None
+        elif isinstance(value, list):
+            value = value[0]
+        else:
+            value = str(value)
+        values[name] = value
+        lookup[name.lower()] = value
+
+    get_value = lookup.get
+    user_data = {'dn': str(dn)}
+    for field, attr in field_attrs:
+        user_data[field] = get_value(attr)
+    user_data['attributes'] = values
+    return user_data
+
+
+def _prefetch_batches(items: Iterator, batch_size: int, depth: int = 2) -> Iterator[List]:
+    """
+    Consume `items` on a worker thread and yield them in lists of up to `batch_size`.
+    
+    At most `depth` batches are buffered, so the producer (LDAP paging) runs ahead of the
+    consumer (database writes) without loading the whole directory. Producer errors are
+    re-raised in the consumer; the worker is joined before returning so the connection it
+    uses can be safely released afterwards.
+    """
+    batches = queue.Queue(maxsize=depth)
+    cancelled = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not cancelled.is_set():
+            try:
+                batches.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    if not put(batch):
+                        return
+                    batch = []
+            if batch and not put(batch):
+                return
+            put(done)
+        except BaseException as e:
+            put(e)
+
+    worker = threading.Thread(target=produce, name="ldap_sync_fetch", daemon=True)
+    worker.start()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is done:
+                return
+            if isinstance(batch, BaseException):
+                raise batch
+            yield batch
+    finally:
+        cancelled.set()
+        worker.join()
+
+
+def _create_server(config):
+    """Create LDAP server instance for a configuration."""
+    if not ldap3:
+        raise ImportError("ldap3 library is required for LDAP functionality")
+
+    tls_config = None
+    if config.use_ssl:
+        tls_config = ldap3.Tls(validate=ssl.CERT_NONE)  # For development, use proper cert validation in production
+
+    return ldap3.Server(
+        host=config.server_host,
+        port=config.server_port,
+        use_ssl=config.use_ssl,
+        tls=tls_config,
+        # Skip the root DSE and schema reads on connect; nothing here uses server.info and
+        # normalize_ldap_entry copes with the unformatted (list) attribute values
+        get_info=NONE,
+        connect_timeout=LDAP_CONNECT_TIMEOUT
+    )
+
+
+def _open_connection(server, user: str, password: str, receive_timeout=LDAP_RECEIVE_TIMEOUT):
+    """
+    Open a connection bound as `user`, for one-off work outside the pool.
+
+    The SYNC strategy sends every request once; rejected credentials raise LDAPBindError.
+    """
+    return Connection(
+        server,
+        user=user,
+        password=password,
+        authentication=SIMPLE,
+        client_strategy=SYNC,
+        auto_bind=True,
+        receive_timeout=receive_timeout,
+        raise_exceptions=True
+    )
+
+
+class LDAPConnectionPool:
+    """Bounded pool of service-account connections for one LDAP configuration."""
+
+    def __init__(self, config):
+        self.config = config
+        self.size = max(int(getattr(config, 'max_pool_size', None) or DEFAULT_POOL_SIZE), 1)
+        self.server_pool = ldap3.ServerPool(
+            [_create_server(config)],
+            pool_strategy=ldap3.ROUND_ROBIN,
+            active=1,
+            exhaust=LDAP_SERVER_EXHAUST_TIME
+        )
+        self._idle = queue.LifoQueue(maxsize=self.size)
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._opened_at: Dict[Any, float] = {}
+        self._closed = False
+
+    def _open(self):
+        """Open a new connection bound with the service account."""
+        connection = Connection(
+            self.server_pool,
+            user=self.config.bind_dn,
+            password=self.config.bind_password,
+            authentication=SIMPLE,
+            client_strategy=ldap3.RESTARTABLE,
+            auto_bind=True,
+            receive_timeout=LDAP_RECEIVE_TIMEOUT,
+            raise_exceptions=True
+        )
+        self._opened_at[connection] = time.monotonic()
+        return connection
+
+    def acquire(self, timeout=LDAP_POOL_ACQUIRE_TIMEOUT):
+        """Take an idle connection from the pool, opening a new one if none is idle."""
+        if not self._slots.acquire(timeout=timeout):
+            raise ConnectionError("LDAP connection pool exhausted")
+        try:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                return self._open()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, connection):
+        """Return a connection to the pool, dropping it if it is no longer usable."""
+        try:
+            if not self._closed and not self._expired(connection) and self._is_healthy(connection):
+                self._idle.put_nowait(connection)
+            else:
+                self._unbind(connection)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Close all idle connections; busy ones are closed when released."""
+        self._closed = True
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._unbind(connection)
+
+    def _expired(self, connection) -> bool:
+        opened_at = self._opened_at.get(connection)
+        return opened_at is None or time.monotonic() - opened_at > LDAP_POOL_LIFETIME
+
+    @staticmethod
+    def _is_healthy(connection) -> bool:
+        if connection.closed or not connection.bound:
+            return False
+        try:
+            connection.extend.standard.who_am_i()
+            return True
+        except LDAPException:
+            return False
+
+    def _unbind(self, connection):
+        self._opened_at.pop(connection, None)
+        try:
+            connection.unbind()
+        except Exception:
+            pass
+
+
+def _pool_signature(config) -> Tuple:
+    """Connection-relevant settings; sync status updates must not recycle the pool."""
+    return (config.server_host, config.server_port, config.use_ssl,
+            config.bind_dn, config.bind_password, getattr(config, 'max_pool_size', None))
+
+
+_connection_pools: Dict[str, LDAPConnectionPool] = {}
+_connection_pools_lock = threading.Lock()
+
+
+def get_connection_pool(config) -> LDAPConnectionPool:
+    """Get the shared connection pool for a configuration, rebuilding it when connection settings changed."""
+    with _connection_pools_lock:
+        pool = _connection_pools.get(config.id)
+        if pool is None or _pool_signature(pool.config) != _pool_signature(config):
+            if pool:
+                pool.close()
+            pool = LDAPConnectionPool(config)
+            _connection_pools[config.id] = pool
+        return pool
+
+
 class LDAPConnectionManager:
     """Manages LDAP server connections and operations."""
     
@@ -38,28 +378,14 @@ class LDAPConnectionManager:
         self.config = config
         self.server = None
         self.connection = None
+        self._pool = None
         
     def _create_server(self):
         """Create LDAP server instance."""
-        if not ldap3:
-            raise ImportError("ldap3 library is required for LDAP functionality")
-            
-        server_uri = f"{'ldaps' if self.config.use_ssl else 'ldap'}://{self.config.server_host}:{self.config.server_port}"
-        
-        tls_config = None
-        if self.config.use_ssl:
-            tls_config = ldap3.Tls(validate=ssl.CERT_NONE)  # For development, use proper cert validation in production
-            
-        self.server = Server(
-            host=self.config.server_host,
-            port=self.config.server_port,
-            use_ssl=self.config.use_ssl,
-            tls=tls_config,
-            get_info=ALL
-        )
+        self.server = _create_server(self.config)
         
-    def connect(self, bind_dn=None, password=None):
-        """Establish connection to LDAP server."""
+    def connect(self, bind_dn=None, password=None, receive_timeout=LDAP_RECEIVE_TIMEOUT):
+        """Establish a dedicated (non-pooled) connection to LDAP server."""
         if not self.server:
             self._create_server()
             
@@ -68,14 +394,7 @@ class LDAPConnectionManager:
         user_password = password or self.config.bind_password
         
         try:
-            self.connection = Connection(
-                self.server,
-                user=user_dn,
-                password=user_password,
-                authentication=SIMPLE,
-                auto_bind=True,
-                raise_exceptions=True
-            )
+            self.connection = _open_connection(self.server, user_dn, user_password, receive_timeout)
             return True
         except LDAPException as e:
             logging.error(f"Failed to connect to LDAP server: {e}")
@@ -86,29 +405,53 @@ class LDAPConnectionManager:
         if self.connection:
             self.connection.unbind()
             self.connection = None
+
+    def verify_credentials(self, user_dn: str, password: str) -> bool:
+        """
+        Check user credentials with a bind on a separate connection to the pool's servers.
+
+        Pooled connections are RESTARTABLE, which resends a request that raised: a rebind with a
+        wrong password there would count twice towards the server's account lockout threshold.
+        The pooled connection also stays bound as the service account.
+        """
+        if not password:
+            # An empty password would be an unauthenticated bind, which servers accept
+            return False
+        try:
+            connection = _open_connection(self._pool.server_pool, user_dn, password)
+        except (LDAPBindError, LDAPInvalidCredentialsResult) as e:
+            # Rejected credentials; other errors (server down, timeouts) are raised
+            logging.warning(f"LDAP bind failed for {user_dn}: {e}")
+            return False
+        try:
+            connection.unbind()
+        except LDAPException:
+            pass
+        return True
             
     def __enter__(self):
-        """Context manager entry."""
-        if not self.connect():
-            raise ConnectionError("Failed to connect to LDAP server")
+        """Context manager entry: borrow a bound connection from the pool."""
+        self._pool = get_connection_pool(self.config)
+        try:
+            self.connection = self._pool.acquire()
+        except Exception as e:
+            logging.error(f"Failed to connect to LDAP server: {e}")
+            raise ConnectionError("Failed to connect to LDAP server") from e
         return self
         
     def __exit__(self, exc_type, exc_val, exc_tb):
-        """Context manager exit."""
-        self.disconnect()
+        """Context manager exit: give the connection back to the pool."""
+        if self.connection is not None:
+            self._pool.release(self.connection)
+            self.connection = None
 
 
 class LDAPAuthenticator:
     """Handles LDAP authentication operations."""
     
-    def __init__(self):
-        self.config = None
-        
     def get_config(self):
-        """Get active LDAP configuration."""
-        if not self.config:
-            self.config = LDAPConfigService.get_active_config()
-        return self.config
+        """Get active LDAP configuration (served from the shared TTL cache, so edits are picked up)."""
+        return LDAPConfigService.get_active_config()
         
     def authenticate_user(self, username: str, password: str) -> Tuple[bool, Optional[Dict]]:
         """
@@ -125,146 +468,151 @@ class LDAPAuthenticator:
             logging.error("LDAP authentication failed: ldap3 library not available")
             return False, None
             
+        dn_key = (config.id, config.search_base, config.search_filter, username)
         try:
+            attempt = _login_attempt_digest(config.id, username, password)
+            with _failed_logins_lock:
+                if attempt in _failed_logins:
+                    logging.warning(f"Repeated failed LDAP login for user {username}, not retried")
+                    return False, None
+                    
             conn_mgr = LDAPConnectionManager(config)
             
-            # First, connect with service account to search for user
+            # Search for the user and read the user attributes with the service account on a
+            # pooled connection; the user credentials are verified on a separate connection
+            with _user_dn_cache_lock:
+                user_dn = _user_dn_cache.get(dn_key)
+            user_info = None
             with conn_mgr:
-                user_dn = self._find_user_dn(conn_mgr.connection, username)
+                if user_dn:
+                    # Read the cached entry with the login filter, so a user who no longer matches
+                    # it (e.g. left the allowed group) is refused at the cost of a BASE lookup
+                    user_info = self._get_user_info(
+                        conn_mgr.connection, user_dn, self._login_filter(config, username)
+                    )
+                    if not user_info:
+                        with _user_dn_cache_lock:
+                            _user_dn_cache.pop(dn_key, None)
+                        user_dn = None
                 if not user_dn:
-                    logging.warning(f"User {username} not found in LDAP")
+                    user_dn, user_info = self._find_user_entry(conn_mgr.connection, username)
+                    if not user_dn:
+                        logging.warning(f"User {username} not found in LDAP")
+                        return False, None
+                    if not config.user_dn_template:
+                        with _user_dn_cache_lock:
+                            _user_dn_cache[dn_key] = user_dn
+                if not conn_mgr.verify_credentials(user_dn, password):
+                    logging.warning(f"Invalid credentials for user {username}")
+                    with _failed_logins_lock:
+                        _failed_logins[attempt] = True
+                    # The cached DN may be stale (user moved or renamed); search again next time
+                    with _user_dn_cache_lock:
+                        _user_dn_cache.pop(dn_key, None)
                     return False, None
                     
-            # Now authenticate with user credentials
-            user_conn_mgr = LDAPConnectionManager(config)
-            if not user_conn_mgr.connect(bind_dn=user_dn, password=password):
-                return False, None
-                
-            try:
-                # Get user information
-                with conn_mgr:
+                # Attributes come with the user search or cache check; only templated DNs need a lookup
+                if user_info is None:
                     user_info = self._get_user_info(conn_mgr.connection, user_dn)
-                    if user_info:
-                        return True, user_info
-            finally:
-                user_conn_mgr.disconnect()
+                if user_info:
+                    return True, user_info
                 
-        except LDAPInvalidCredentialsError:
-            logging.warning(f"Invalid credentials for user {username}")
         except LDAPException as e:
             logging.error(f"LDAP authentication error for user {username}: {e}")
+            with _user_dn_cache_lock:
+                _user_dn_cache.pop(dn_key, None)
         except Exception as e:
             logging.exception(f"Unexpected error during LDAP authentication for user {username}: {e}")
             
         return False, None
         
-    def _find_user_dn(self, connection: Connection, username: str) -> Optional[str]:
-        """Find user DN by username."""
+    def _find_user_entry(self, connection: Connection, username: str) -> Tuple[Optional[str], Optional[Dict]]:
+        """
+        Find a user by username.
+        
+        Returns:
+            Tuple[Optional[str], Optional[Dict]]: (user_dn, user_info). The mapped attributes are
+            fetched by the same search; user_info is None when the DN comes from user_dn_template.
+        """
         config = self.get_config()
         if not config:
-            return None
+            return None, None
             
         # If user DN template is provided, use it directly
         if config.user_dn_template:
-            return config.user_dn_template.format(username=username)
+            return config.user_dn_template.format(username=escape_rdn(username)), None
             
         # Otherwise search for the user
-        search_filter = config.search_filter
-        if '{}' in search_filter:
-            search_filter = search_filter.format(username)
-        elif '{username}' in search_filter:
-            search_filter = search_filter.format(username=username)
-        else:
-            # Default search filter
-            username_attr = config.attr_mapping.get('username', 'uid')
-            search_filter = f"({username_attr}={username})"
+        search_filter = self._login_filter(config, username)
             
         try:
             connection.search(
                 search_base=config.search_base,
                 search_filter=search_filter,
-                attributes=['dn']
+                attributes=_search_attributes(config.attr_mapping)
             )
             
-            if connection.entries:
-                return str(connection.entries[0].entry_dn)
+            for entry in connection.response or ():
+                if entry.get('type') == 'searchResEntry':
+                    user_info = normalize_ldap_entry(entry['dn'], entry['attributes'], config.attr_mapping)
+                    return user_info['dn'], user_info
                 
         except LDAPException as e:
             logging.error(f"Error searching for user {username}: {e}")
             
-        return None
+        return None, None
         
-    def _get_user_info(self, connection: Connection, user_dn: str) -> Optional[Dict]:
-        """Get user information from LDAP."""
+    @staticmethod
+    def _login_filter(config, username: str) -> str:
+        """The search filter matching `username` under the configured login restrictions."""
+        filter_template = _user_filter_template(
+            config.search_filter, config.attr_mapping.get('username', 'uid')
+        )
+        # Escape the username so '*', '(' etc. cannot widen the filter into a subtree scan
+        return filter_template.format(username=escape_filter_chars(username))
+        
+    def _get_user_info(self, connection: Connection, user_dn: str,
+                       search_filter: str = '(objectClass=*)') -> Optional[Dict]:
+        """Get user information from LDAP, or None if the entry does not match `search_filter`."""
         config = self.get_config()
         if not config:
             return None
             
         try:
             # Get all mapped attributes
-            attrs = list(config.attr_mapping.values()) + ['dn', 'cn']
+            attrs = _search_attributes(config.attr_mapping)
             
             connection.search(
                 search_base=user_dn,
-                search_filter='(objectClass=*)',
+                search_filter=search_filter,
                 search_scope='BASE',
                 attributes=attrs
             )
             
-            if not connection.entries:
-                return None
-                
-            entry = connection.entries[0]
-            user_info = {
-                'dn': str(entry.entry_dn),
-                'username': self._get_attr_value(entry, config.attr_mapping.get('username', 'uid')),
-                'email': self._get_attr_value(entry, config.attr_mapping.get('email', 'mail')),
-                'nickname': self._get_attr_value(entry, config.attr_mapping.get('nickname', 'displayName')),
-                'first_name': self._get_attr_value(entry, config.attr_mapping.get('first_name', 'givenName')),
-                'last_name': self._get_attr_value(entry, config.attr_mapping.get('last_name', 'sn')),
-                'attributes': {}
-            }
-            
-            # Store all attributes for debugging/reference
-            for attr in entry.entry_attributes:
-                user_info['attributes'][attr] = self._get_attr_value(entry, attr)
-                
-            return user_info
+            for entry in connection.response or ():
+                if entry.get('type') == 'searchResEntry':
+                    return normalize_ldap_entry(entry['dn'], entry['attributes'], config.attr_mapping)
+            return None
             
         except LDAPException as e:
             logging.error(f"Error getting user info for {user_dn}: {e}")
             return None
-            
-    def _get_attr_value(self, entry, attr_name: str) -> Optional[str]:
-        """Get attribute value from LDAP entry."""
-        if not hasattr(entry, attr_name):
-            return None
-            
-        attr = getattr(entry, attr_name)
-        if attr and attr.value:
-            # Handle multi-value attributes
-            if isinstance(attr.value, list):
-                return attr.value[0] if attr.value else None
-            return str(attr.value)
-        return None
 
 
 class LDAPSyncService:
     """Handles LDAP user synchronization."""
     
-    def __init__(self):
-        self.config = None
-        
     def get_config(self):
-        """Get active LDAP configuration."""
-        if not self.config:
-            self.config = LDAPConfigService.get_active_config()
-        return self.config
+        """Get active LDAP configuration (served from the shared TTL cache, so edits are picked up)."""
+        return LDAPConfigService.get_active_config()
         
-    def sync_users(self) -> Tuple[bool, Dict[str, int]]:
+    def sync_users(self, full: bool = False) -> Tuple[bool, Dict[str, int]]:
         """
         Synchronize users from LDAP.
         
+        Args:
+            full: Rescan the whole directory even if an incremental sync is possible.
+        
         Returns:
             Tuple[bool, Dict[str, int]]: (success, stats)
         """
@@ -284,51 +632,43 @@ class LDAPSyncService:
             'errors': 0
         }
         
+        started_at = datetime.now(timezone.utc)
+        modified_since = None if full else self._incremental_since(config, started_at)
+        
         try:
             # Update sync status to running
             LDAPConfigService.update_sync_status(config.id, 'running')
             
             conn_mgr = LDAPConnectionManager(config)
-            with conn_mgr:
-                # Get all users from LDAP
-                ldap_users = self._get_all_ldap_users(conn_mgr.connection)
-                stats['total_found'] = len(ldap_users)
+            active_dns = []
+            # Write users in batches as the directory pages arrive, one short transaction per
+            # batch: logins updating these rows must not wait for the whole directory read
+            with conn_mgr, DB.connection_context():
+                # The next page is fetched from LDAP while the current batch is written
+                ldap_users = self._get_all_ldap_users(conn_mgr.connection, config, modified_since)
+                for batch in _prefetch_batches(ldap_users, UPSERT_BATCH_SIZE):
+                    if modified_since is None:
+                        active_dns.extend(ldap_user_data['dn'] for ldap_user_data in batch)
+                    stats['total_found'] += len(batch)
+                    with DB.atomic():
+                        self._write_batch(config, batch, stats)
                 
-                active_dns = []
-                
-                for ldap_user_data in ldap_users:
-                    try:
-                        ldap_user, created = LDAPUserService.create_or_update_user(
-                            config.id, ldap_user_data
+                # Mark inactive users; only a completed full rescan knows which users are gone.
+                # A failed read raises before this, so committed batches never trigger it
+                if modified_since is None:
+                    with DB.atomic():
+                        stats['deactivated'] = LDAPUserService.mark_stale_users(
+                            config.id, active_dns
                         )
-                        
-                        if ldap_user:
-                            active_dns.append(ldap_user_data['dn'])
-                            if created:
-                                stats['created'] += 1
-                                # Auto-create system user if enabled
-                                if config.auto_create_user:
-                                    self._create_system_user(ldap_user)
-                            else:
-                                stats['updated'] += 1
-                        else:
-                            stats['errors'] += 1
-                            
-                    except Exception as e:
-                        logging.exception(f"Error processing LDAP user: {e}")
-                        stats['errors'] += 1
-                
-                # Mark inactive users
-                stats['deactivated'] = LDAPUserService.mark_stale_users(
-                    config.id, active_dns
-                )
                 
-            # Update sync status to completed
+            # Update sync status to completed. Service methods that open and close their own
+            # connection cannot run inside a transaction: closing it there raises
             LDAPConfigService.update_sync_status(
                 config.id, 'completed', datetime.now()
             )
+            self._record_sync(config, started_at, full=modified_since is None)
             
-            logging.info(f"LDAP sync completed: {stats}")
+            logging.info(f"LDAP sync completed ({'incremental' if modified_since else 'full'}): {stats}")
             return True, stats
             
         except Exception as e:
@@ -336,97 +676,132 @@ class LDAPSyncService:
             LDAPConfigService.update_sync_status(config.id, 'error')
             return False, stats
             
-    def _get_all_ldap_users(self, connection: Connection) -> List[Dict]:
-        """Get all users from LDAP directory."""
-        config = self.get_config()
-        if not config:
-            return []
-            
-        users = []
-        try:
-            # Get all mapped attributes
-            attrs = list(config.attr_mapping.values()) + ['dn', 'cn']
-            
-            connection.search(
-                search_base=config.search_base,
-                search_filter=config.search_filter,
-                attributes=attrs
-            )
-            
-            for entry in connection.entries:
-                user_data = {
-                    'dn': str(entry.entry_dn),
-                    'username': self._get_attr_value(entry, config.attr_mapping.get('username', 'uid')),
-                    'email': self._get_attr_value(entry, config.attr_mapping.get('email', 'mail')),
-                    'nickname': self._get_attr_value(entry, config.attr_mapping.get('nickname', 'displayName')),
-                    'first_name': self._get_attr_value(entry, config.attr_mapping.get('first_name', 'givenName')),
-                    'last_name': self._get_attr_value(entry, config.attr_mapping.get('last_name', 'sn')),
-                    'is_active': True,
-                    'attributes': {}
-                }
-                
-                # Store all attributes
-                for attr in entry.entry_attributes:
-                    user_data['attributes'][attr] = self._get_attr_value(entry, attr)
-                    
-                users.append(user_data)
-                
-        except LDAPException as e:
-            logging.error(f"Error getting LDAP users: {e}")
-            
-        return users
+    @staticmethod
+    def _sync_signature(config) -> Tuple:
+        """Settings that change which entries or attributes a sync reads."""
+        return config.search_base, config.search_filter, tuple(sorted(config.attr_mapping.items()))
         
-    def _get_attr_value(self, entry, attr_name: str) -> Optional[str]:
-        """Get attribute value from LDAP entry."""
-        if not hasattr(entry, attr_name):
+    def _incremental_since(self, config, now: datetime) -> Optional[datetime]:
+        """Return the modifyTimestamp lower bound for an incremental sync, or None for a full rescan."""
+        state = _sync_state.get(config.id)
+        if (not state or state['signature'] != self._sync_signature(config)
+                or now - state['last_full_sync'] >= LDAP_FULL_SYNC_INTERVAL):
             return None
-            
-        attr = getattr(entry, attr_name)
-        if attr and attr.value:
-            # Handle multi-value attributes
-            if isinstance(attr.value, list):
-                return attr.value[0] if attr.value else None
-            return str(attr.value)
-        return None
+        return state['last_sync'] - LDAP_INCREMENTAL_OVERLAP
         
-    def _create_system_user(self, ldap_user) -> bool:
-        """Create system user from LDAP user data."""
-        try:
-            # Check if system user already exists
-            if ldap_user.email:
-                existing_users = UserService.query(email=ldap_user.email)
-                if existing_users:
-                    # Link LDAP user to existing system user
-                    LDAPUserService.model.update(
-                        user_id=existing_users[0].id
-                    ).where(
-                        LDAPUserService.model.id == ldap_user.id
-                    ).execute()
-                    return True
+    def _record_sync(self, config, started_at: datetime, full: bool):
+        state = _sync_state.get(config.id)
+        _sync_state[config.id] = {
+            'signature': self._sync_signature(config),
+            'last_sync': started_at,
+            'last_full_sync': started_at if full or not state else state['last_full_sync']
+        }
+        
+    def _write_batch(self, config, ldap_users: List[Dict], stats: Dict[str, int]):
+        """Upsert one batch of directory users and create their system users if enabled."""
+        created_users, updated = LDAPUserService.bulk_upsert(config.id, ldap_users)
+        stats['created'] += len(created_users)
+        stats['updated'] += updated
+        
+        # Auto-create system users if enabled
+        if config.auto_create_user and created_users:
+            stats['errors'] += self._create_system_users(created_users)
                     
-            # Create new system user
-            user_data = {
-                'id': get_uuid(),
-                'email': ldap_user.email or f"{ldap_user.ldap_username}@ldap.local",
-                'nickname': ldap_user.nickname or ldap_user.ldap_username,
-                'password': '',  # No password for LDAP users
-                'login_channel': 'ldap',
-                'last_login_time': get_format_time(),
-                'is_superuser': False,
-                'status': '1'
+    def _get_all_ldap_users(self, connection: Connection, config=None,
+                            modified_since: Optional[datetime] = None) -> Iterator[Dict]:
+        """
+        Yield all users from LDAP directory, one page of entries at a time. With
+        `modified_since` (UTC), only entries changed since then are returned.
+        
+        Search errors are raised rather than swallowed: a truncated result would otherwise
+        deactivate every user that was not returned.
+        """
+        config = config or self.get_config()
+        if not config:
+            return
+            
+        # Get all mapped attributes
+        attrs = _search_attributes(config.attr_mapping)
+        field_attrs = _field_attrs(config.attr_mapping)
+        
+        search_filter = config.search_filter
+        if modified_since:
+            if not search_filter.startswith('('):
+                search_filter = f"({search_filter})"
+            search_filter = f"(&{search_filter}(modifyTimestamp>={modified_since:%Y%m%d%H%M%SZ}))"
+        
+        entries = connection.extend.standard.paged_search(
+            search_base=config.search_base,
+            search_filter=search_filter,
+            attributes=attrs,
+            paged_size=LDAP_SYNC_PAGE_SIZE,
+            generator=True
+        )
+        for entry in entries:
+            if entry.get('type') != 'searchResEntry':
+                continue
+            user_data = _normalize_entry(entry['dn'], entry['attributes'], field_attrs)
+            user_data['is_active'] = True
+            yield user_data
+        
+    def _create_system_users(self, ldap_users: List) -> int:
+        """
+        Link new LDAP users to existing system users by email, creating system users for the
+        rest. Emails are resolved with one query and the links written with one UPDATE.
+        
+        Returns:
+            int: number of LDAP users that could not be linked
+        """
+        user_model = UserService.model
+        emails = list({ldap_user.email for ldap_user in ldap_users if ldap_user.email})
+        user_ids_by_email = {}
+        if emails:
+            user_ids_by_email = {
+                email: user_id for user_id, email in user_model.select(user_model.id, user_model.email).where(
+                    user_model.email.in_(emails)
+                ).tuples()
             }
             
-            system_user = UserService.save(**user_data)
-            if system_user:
-                # Link LDAP user to system user
-                LDAPUserService.model.update(
-                    user_id=system_user.id
-                ).where(
-                    LDAPUserService.model.id == ldap_user.id
-                ).execute()
-                return True
-                
+        links = {}
+        errors = 0
+        for ldap_user in ldap_users:
+            user_id = user_ids_by_email.get(ldap_user.email) if ldap_user.email else None
+            if not user_id:
+                user_id = self._create_system_user(ldap_user)
+                if not user_id:
+                    errors += 1
+                    continue
+                if ldap_user.email:
+                    # Later LDAP users with the same email link to this one
+                    user_ids_by_email[ldap_user.email] = user_id
+            links[ldap_user.id] = user_id
+            
+        LDAPUserService.link_system_users(links)
+        return errors
+        
+    def _create_system_user(self, ldap_user) -> Optional[str]:
+        """Create a system user from LDAP user data and return its id."""
+        user_data = {
+            'id': get_uuid(),
+            'email': ldap_user.email or f"{ldap_user.ldap_username}@ldap.local",
+            'nickname': ldap_user.nickname or ldap_user.ldap_username,
+            'password': '',  # No password for LDAP users
+            'login_channel': 'ldap',
+            'last_login_time': get_format_time(),
+            'is_superuser': False,
+            'status': '1'
+        }
+        try:
+            # Savepoint, so a failure here does not abort the surrounding sync transaction
+            with DB.atomic():
+                UserService._save(**user_data)
+            return user_data['id']
         except Exception as e:
             logging.exception(f"Failed to create system user for LDAP user {ldap_user.id}: {e}")
-            
-        return False
\ No newline at end of file
+            return None
+
+
+# Shared instances; they keep no per-request state, so the DN, failed-login and config caches
+# are reused across requests and scheduler runs
+authenticator = LDAPAuthenticator()
+sync_service = LDAPSyncService()
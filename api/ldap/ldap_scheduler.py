@@ -16,12 +16,100 @@
 import asyncio
 import logging
 import threading
-import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from typing import Optional
 
+from cachetools import TTLCache
+
 from api.db.services.ldap_service import LDAPConfigService
-from api.ldap.ldap_auth import LDAPSyncService
+from api.ldap.ldap_auth import sync_service
+from api.utils import get_uuid
+from rag.utils.redis_conn import RedisDistributedLock
+
+# 未启用同步时的检查间隔，以及出错后的重试间隔
+SCHEDULER_IDLE_INTERVAL = 10.0
+SCHEDULER_ERROR_INTERVAL = 30.0
+MIN_SYNC_INTERVAL = 30.0
+# 多个worker进程共用的同步锁，超时时间需覆盖一次完整同步
+LDAP_SYNC_LOCK_KEY = "ldap_sync"
+LDAP_SYNC_LOCK_TIMEOUT = 3600
+
+# 同步与异步调度器共享同一个同步服务和最后同步时间，同时运行时不会重复同步
+_last_sync_time = {}  # config_id -> last_sync_time
+
+
+def _get_sync_config():
+    """获取启用了自动同步的LDAP配置"""
+    config = LDAPConfigService.get_active_config()
+    if not config or not config.enabled or not config.sync_enabled:
+        return None
+    return config
+
+
+def _seconds_until_sync(config, now: datetime) -> float:
+    """距离下一次计划同步的秒数，小于等于0表示应立即同步"""
+    last_sync = _last_sync_time.get(config.id)
+    if not last_sync:
+        return 0.0
+    sync_interval = max(config.sync_interval, MIN_SYNC_INTERVAL)  # 最小30秒
+    return sync_interval - (now - last_sync).total_seconds()
+
+
+def _next_check_delay(remaining: float) -> float:
+    """间隔可能在此期间被修改，最多等待一个配置缓存周期后重新检查"""
+    return float(min(max(remaining, 0), MIN_SYNC_INTERVAL))
+
+
+# 进程内的同步锁：调度线程、异步调度器和手动同步任务不会在同一进程内重叠执行
+_local_sync_lock = threading.Lock()
+
+
+@contextmanager
+def _cluster_sync_lock():
+    """同步锁，保证进程内及多个worker之间同一时间只有一个LDAP同步在执行，返回是否获取成功"""
+    if not _local_sync_lock.acquire(blocking=False):
+        yield False
+        return
+    try:
+        lock = RedisDistributedLock(LDAP_SYNC_LOCK_KEY, timeout=LDAP_SYNC_LOCK_TIMEOUT)
+        acquired = lock.acquire()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+    finally:
+        _local_sync_lock.release()
+
+
+def _run_once(config) -> bool:
+    """执行一次同步并记录同步时间"""
+    started_at = datetime.now()
+    with _cluster_sync_lock() as acquired:
+        if not acquired:
+            # 已有同步在执行，等待下一个同步周期
+            logging.info(f"LDAP sync for config {config.id} is already in progress, skipped")
+            _last_sync_time[config.id] = started_at
+            return False
+            
+        # 其他worker可能已在本周期内完成同步，以数据库中的最后同步时间为准
+        model = LDAPConfigService.model
+        latest = LDAPConfigService.get_active_config(cols=[model.id, model.last_sync_time])
+        if latest and latest.last_sync_time:
+            _last_sync_time[config.id] = latest.last_sync_time
+            if _seconds_until_sync(config, datetime.now()) > 0:
+                return True
+                
+        logging.info(f"Starting LDAP sync for config {config.id}")
+        _last_sync_time[config.id] = started_at
+        success, stats = sync_service.sync_users()
+    if success:
+        logging.info(f"LDAP sync completed successfully: {stats}")
+    else:
+        logging.error(f"LDAP sync failed: {stats}")
+    return success
 
 
 class LDAPScheduler:
@@ -30,8 +118,14 @@ class LDAPScheduler:
     def __init__(self):
         self.running = False
         self.thread = None
-        self.sync_service = LDAPSyncService()
-        self.last_sync_time = {}  # config_id -> last_sync_time
+        self.sync_service = sync_service
+        self.last_sync_time = _last_sync_time
+        # stop()时置位，唤醒等待中的调度线程
+        self._stop_event = threading.Event()
+        # 手动同步在单独的工作线程中执行，不占用请求线程
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ldap_sync")
+        self._jobs = TTLCache(maxsize=64, ttl=3600)  # job_id -> Future
+        self._jobs_lock = threading.Lock()
         
     def start(self):
         """启动调度器"""
@@ -40,6 +134,7 @@ class LDAPScheduler:
             return
             
         self.running = True
+        self._stop_event.clear()
         self.thread = threading.Thread(target=self._run_scheduler, daemon=True)
         self.thread.start()
         logging.info("LDAP scheduler started")
@@ -47,58 +142,47 @@ class LDAPScheduler:
     def stop(self):
         """停止调度器"""
         self.running = False
+        self._stop_event.set()
         if self.thread and self.thread.is_alive():
             self.thread.join(timeout=5)
         logging.info("LDAP scheduler stopped")
         
     def _run_scheduler(self):
-        """运行调度器主循环"""
+        """运行调度器主循环，睡眠到下一次计划同步，stop()可立即唤醒"""
         while self.running:
             try:
-                self._check_and_sync()
-                time.sleep(10)  # 每10秒检查一次
+                delay = self._check_and_sync()
             except Exception as e:
                 logging.exception(f"Error in LDAP scheduler: {e}")
-                time.sleep(30)  # 出错时等待30秒后重试
+                delay = SCHEDULER_ERROR_INTERVAL  # 出错时等待30秒后重试
+            if self._stop_event.wait(delay):
+                break
                 
-    def _check_and_sync(self):
-        """检查并执行同步"""
+    def _check_and_sync(self) -> float:
+        """检查并执行同步，返回距离下一次检查的秒数"""
         try:
-            # 获取所有启用的LDAP配置
-            config = LDAPConfigService.get_active_config()
-            if not config or not config.enabled or not config.sync_enabled:
-                return
+            config = _get_sync_config()
+            if not config:
+                return SCHEDULER_IDLE_INTERVAL
                 
-            # 检查是否需要同步
-            now = datetime.now()
-            last_sync = self.last_sync_time.get(config.id)
-            
-            # 计算同步间隔
-            sync_interval = max(config.sync_interval, 30)  # 最小30秒
-            
-            if (not last_sync or 
-                (now - last_sync).total_seconds() >= sync_interval):
-                
-                logging.info(f"Starting LDAP sync for config {config.id}")
-                
-                # 更新同步状态
-                self.last_sync_time[config.id] = now
-                
-                # 执行同步
-                success, stats = self.sync_service.sync_users()
+            remaining = _seconds_until_sync(config, datetime.now())
+            if remaining <= 0:
+                _run_once(config)
+                remaining = MIN_SYNC_INTERVAL
+            return _next_check_delay(remaining)
                 
-                if success:
-                    logging.info(f"LDAP sync completed successfully: {stats}")
-                else:
-                    logging.error(f"LDAP sync failed: {stats}")
-                    
         except Exception as e:
             logging.exception(f"Error during LDAP sync check: {e}")
+            return SCHEDULER_ERROR_INTERVAL
             
     def force_sync(self) -> bool:
-        """强制执行一次同步"""
+        """强制执行一次完整同步"""
         try:
-            success, stats = self.sync_service.sync_users()
+            with _cluster_sync_lock() as acquired:
+                if not acquired:
+                    logging.warning("LDAP sync is already in progress")
+                    return False
+                success, stats = self.sync_service.sync_users(full=True)
             if success:
                 logging.info(f"Forced LDAP sync completed: {stats}")
                 # 更新最后同步时间
@@ -109,6 +193,19 @@ class LDAPScheduler:
         except Exception as e:
             logging.exception(f"Error during forced LDAP sync: {e}")
             return False
+            
+    def submit_sync(self) -> str:
+        """提交一次异步同步任务，返回任务ID"""
+        job_id = get_uuid()
+        future = self._executor.submit(self.force_sync)
+        with self._jobs_lock:
+            self._jobs[job_id] = future
+        return job_id
+        
+    def get_sync_job(self, job_id: str) -> Optional[Future]:
+        """获取同步任务"""
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
 
 
 # 全局调度器实例
@@ -128,6 +225,16 @@ def stop_ldap_scheduler():
 def force_ldap_sync():
     """强制执行LDAP同步"""
     return ldap_scheduler.force_sync()
+    
+
+def submit_ldap_sync():
+    """提交异步LDAP同步任务，返回任务ID"""
+    return ldap_scheduler.submit_sync()
+    
+
+def get_ldap_sync_job(job_id):
+    """获取异步LDAP同步任务"""
+    return ldap_scheduler.get_sync_job(job_id)
 
 
 class LDAPBackgroundTask:
@@ -159,13 +266,14 @@ class LDAPBackgroundTask:
 
 # 异步版本的调度器
 class AsyncLDAPScheduler:
-    """异步LDAP调度器"""
+    """异步LDAP调度器，与同步版本共享调度逻辑"""
     
     def __init__(self):
         self.running = False
         self.task = None
-        self.sync_service = LDAPSyncService()
-        self.last_sync_time = {}
+        self.sync_service = sync_service
+        self.last_sync_time = _last_sync_time
+        self._stop_event = None
         
     async def start(self):
         """启动异步调度器"""
@@ -173,12 +281,15 @@ class AsyncLDAPScheduler:
             return
             
         self.running = True
+        self._stop_event = asyncio.Event()
         self.task = asyncio.create_task(self._run_scheduler())
         logging.info("Async LDAP scheduler started")
         
     async def stop(self):
         """停止异步调度器"""
         self.running = False
+        if self._stop_event:
+            self._stop_event.set()
         if self.task:
             self.task.cancel()
             try:
@@ -191,45 +302,37 @@ class AsyncLDAPScheduler:
         """运行异步调度器主循环"""
         while self.running:
             try:
-                await self._check_and_sync()
-                await asyncio.sleep(10)  # 每10秒检查一次
+                delay = await self._check_and_sync()
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logging.exception(f"Error in async LDAP scheduler: {e}")
-                await asyncio.sleep(30)
+                delay = SCHEDULER_ERROR_INTERVAL
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=delay)
+                break
+            except asyncio.TimeoutError:
+                pass
                 
-    async def _check_and_sync(self):
-        """异步检查并执行同步"""
+    async def _check_and_sync(self) -> float:
+        """异步检查并执行同步，返回距离下一次检查的秒数"""
         try:
-            config = LDAPConfigService.get_active_config()
-            if not config or not config.enabled or not config.sync_enabled:
-                return
-                
-            now = datetime.now()
-            last_sync = self.last_sync_time.get(config.id)
-            sync_interval = max(config.sync_interval, 30)
-            
-            if (not last_sync or 
-                (now - last_sync).total_seconds() >= sync_interval):
-                
-                logging.info(f"Starting async LDAP sync for config {config.id}")
-                self.last_sync_time[config.id] = now
+            config = _get_sync_config()
+            if not config:
+                return SCHEDULER_IDLE_INTERVAL
                 
+            remaining = _seconds_until_sync(config, datetime.now())
+            if remaining <= 0:
                 # 在线程池中运行同步操作
-                loop = asyncio.get_event_loop()
-                success, stats = await loop.run_in_executor(
-                    None, self.sync_service.sync_users
-                )
-                
-                if success:
-                    logging.info(f"Async LDAP sync completed: {stats}")
-                else:
-                    logging.error(f"Async LDAP sync failed: {stats}")
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, _run_once, config)
+                remaining = MIN_SYNC_INTERVAL
+            return _next_check_delay(remaining)
                     
         except Exception as e:
             logging.exception(f"Error during async LDAP sync: {e}")
+            return SCHEDULER_ERROR_INTERVAL
 
 
 # 全局异步调度器实例  
-async_ldap_scheduler = AsyncLDAPScheduler()
\ No newline at end of file
+async_ldap_scheduler = AsyncLDAPScheduler()
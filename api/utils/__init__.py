@@ -27,6 +27,7 @@ import requests
 import logging
 import copy
 from enum import Enum, IntEnum
+from functools import lru_cache
 import importlib
 from Cryptodome.PublicKey import RSA
 from Cryptodome.Cipher import PKCS1_v1_5 as Cipher_pkcs1_v1_5
@@ -363,13 +364,20 @@ def elapsed2time(elapsed):
     return '%02d:%02d:%02d' % (hour, minuter, second)
 
 
-def decrypt(line):
+@lru_cache(maxsize=1)
+def _private_key_cipher():
+    # Reading and unlocking the PEM dominates decrypt(), so do it once per process
     file_path = os.path.join(
         file_utils.get_project_base_directory(),
         "conf",
         "private.pem")
-    rsa_key = RSA.importKey(open(file_path).read(), "Welcome")
-    cipher = Cipher_pkcs1_v1_5.new(rsa_key)
+    with open(file_path) as f:
+        rsa_key = RSA.importKey(f.read(), "Welcome")
+    return Cipher_pkcs1_v1_5.new(rsa_key)
+
+
+def decrypt(line):
+    cipher = _private_key_cipher()
     return cipher.decrypt(base64.b64decode(
         line), "Fail to decrypt password!").decode('utf-8')
 
@@ -35,6 +35,7 @@ import requests
 import trio
 from flask import (
     Response,
+    current_app,
     jsonify,
     make_response,
     send_file,
@@ -46,6 +47,11 @@ from itsdangerous import URLSafeTimedSerializer
 from peewee import OperationalError
 from werkzeug.http import HTTP_STATUS_CODES
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from api import settings
 from api.constants import REQUEST_MAX_WAIT_SEC, REQUEST_WAIT_SEC
 from api.db.db_models import APIToken
@@ -215,9 +221,22 @@ def send_file_in_mem(data, filename):
     return send_file(f, as_attachment=True, attachment_filename=filename)
 
 
+def _json_response(payload):
+    # orjson is several times faster than the stdlib encoder behind jsonify. Dates are
+    # passed through to Flask's default handler so the wire format stays the same.
+    if orjson is None:
+        return jsonify(payload)
+    body = orjson.dumps(
+        payload,
+        default=current_app.json.default,
+        option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+    )
+    return current_app.response_class(body, mimetype="application/json")
+
+
 def get_json_result(code=settings.RetCode.SUCCESS, message="success", data=None):
     response = {"code": code, "message": message, "data": data}
-    return jsonify(response)
+    return _json_response(response)
 
 
 def apikey_required(func):
@@ -248,7 +267,7 @@ def construct_response(code=settings.RetCode.SUCCESS, message="success", data=No
             continue
         else:
             response_dict[key] = value
-    response = make_response(jsonify(response_dict))
+    response = make_response(_json_response(response_dict))
     if auth:
         response.headers["Authorization"] = auth
     response.headers["Access-Control-Allow-Origin"] = "*"
@@ -12,12 +12,7 @@ import json
 import asyncio
 from datetime import datetime
 
-# 添加项目路径
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
-
-from api.db.services.ldap_service import LDAPConfigService, LDAPUserService
-from api.ldap.ldap_auth import LDAPAuthenticator, LDAPSyncService
-from api.ldap.ldap_scheduler import LDAPScheduler
+# RAGFlow模块在各示例函数内按需导入，导入本文件不会加载数据库服务
 
 
 def example_ldap_config():
@@ -50,6 +45,7 @@ def example_ldap_config():
     # 注意：这只是示例，实际使用需要数据库连接
     print(f"配置数据: {json.dumps(config_data, indent=2, ensure_ascii=False)}")
     
+    # from api.db.services.ldap_service import LDAPConfigService
     # config = LDAPConfigService.create_config(config_data)
     # if config:
     #     print(f"LDAP配置创建成功，ID: {config.id}")
@@ -61,6 +57,7 @@ def example_ldap_auth():
     """示例：LDAP用户认证"""
     print("\n=== LDAP用户认证示例 ===")
     
+    from api.ldap.ldap_auth import LDAPAuthenticator
     authenticator = LDAPAuthenticator()
     
     # 模拟认证
@@ -88,6 +85,7 @@ def example_ldap_sync():
     """示例：LDAP用户同步"""
     print("\n=== LDAP用户同步示例 ===")
     
+    from api.ldap.ldap_auth import LDAPSyncService
     sync_service = LDAPSyncService()
     
     print("同步流程:")
@@ -110,6 +108,7 @@ def example_ldap_scheduler():
     """示例：LDAP调度器使用"""
     print("\n=== LDAP调度器示例 ===")
     
+    from api.ldap.ldap_scheduler import LDAPScheduler
     scheduler = LDAPScheduler()
     
     print("调度器功能:")
@@ -143,8 +142,9 @@ def example_user_management():
     print("4. 清理过期用户")
     
     # 注意：实际使用需要数据库连接
+    # from api.db.services.ldap_service import LDAPUserService
     # users = LDAPUserService.get_users_by_config(config_id)
-    # print(f"找到 {len(users)} 个用户")
+    # print(f"找到 {users.count()} 个用户")
     
     # # 更新用户状态
     # success = LDAPUserService.set_user_status("user123", False)
@@ -259,4 +259,6 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # 添加项目路径
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    main()
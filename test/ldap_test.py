@@ -20,59 +20,109 @@ LDAP模块测试用例
 python -m pytest test/ldap_test.py -v
 """
 
+import asyncio
+import os
+import tempfile
 import pytest
 import unittest
-from unittest.mock import Mock, patch, MagicMock
-from datetime import datetime
+from types import MappingProxyType, SimpleNamespace
+from unittest.mock import ANY, Mock, patch, MagicMock
+from datetime import datetime, timedelta, timezone
 
+from ldap3 import Server, Connection, MOCK_SYNC
+from peewee import SqliteDatabase
+
+from api.db.db_models import LDAPConfig, LDAPUser, User
+from api.db.services import ldap_service
 from api.db.services.ldap_service import LDAPConfigService, LDAPUserService
-from api.ldap.ldap_auth import LDAPAuthenticator, LDAPSyncService, LDAPConnectionManager
+from api.ldap.ldap_auth import (
+    LDAPAuthenticator, LDAPSyncService, LDAPConnectionManager, LDAPConnectionPool, normalize_ldap_entry,
+    LDAP_POOL_LIFETIME, LDAP_FULL_SYNC_INTERVAL, LDAP_INCREMENTAL_OVERLAP, _prefetch_batches
+)
+from api.ldap.ldap_scheduler import LDAPScheduler, AsyncLDAPScheduler, _local_sync_lock, _seconds_until_sync, _next_check_delay
+from api.ldap import ldap_auth, ldap_scheduler
+
+# LDAP配置的必需字段
+REQUIRED_CONFIG_FIELDS = frozenset({'name', 'server_host', 'server_port', 'search_base'})
+
+# 属性映射测试共用的只读数据
+ATTR_MAPPING = MappingProxyType({
+    'username': 'uid',
+    'email': 'mail',
+    'nickname': 'displayName',
+    'first_name': 'givenName',
+    'last_name': 'sn'
+})
+
+# 模拟LDAP属性（与ldap3返回的格式一致，属性值为列表）
+LDAP_ATTRS = MappingProxyType({
+    'uid': ['testuser'],
+    'mail': ['testuser@test.com'],
+    'displayName': ['Test User'],
+    'givenName': ['Test'],
+    'sn': ['User']
+})
+
 
+def _mock_ldap_connection():
+    """已绑定的ldap3模拟连接，目录中包含一个测试用户，搜索结果与真实服务器格式一致"""
+    connection = Connection(
+        Server('mock_ldap'), user='cn=admin,dc=test,dc=com', password='secret',
+        client_strategy=MOCK_SYNC
+    )
+    connection.strategy.add_entry('cn=admin,dc=test,dc=com', {'userPassword': 'secret', 'sn': 'admin'})
+    connection.strategy.add_entry(
+        'uid=testuser,ou=users,dc=test,dc=com',
+        dict(LDAP_ATTRS, objectClass=['person'], cn=['Test User'])
+    )
+    connection.bind()
+    return connection
 
+
+@patch.object(LDAPConfigService, 'model')
 class TestLDAPConfigService(unittest.TestCase):
     """测试LDAP配置服务"""
     
-    def setUp(self):
-        self.config_data = {
-            'name': 'Test LDAP',
-            'server_host': 'ldap.test.com',
-            'server_port': 389,
-            'use_ssl': False,
-            'bind_dn': 'cn=admin,dc=test,dc=com',
-            'bind_password': 'password',
-            'search_base': 'ou=users,dc=test,dc=com',
-            'search_filter': '(objectClass=person)',
-            'attr_mapping': {
-                'username': 'uid',
-                'email': 'mail',
-                'nickname': 'displayName'
-            },
-            'enabled': True,
-            'auto_create_user': True,
-            'sync_enabled': True,
-            'sync_interval': 30
-        }
+    # 只读的共享测试数据，需要修改的测试自行复制
+    CONFIG_DATA = MappingProxyType({
+        'name': 'Test LDAP',
+        'server_host': 'ldap.test.com',
+        'server_port': 389,
+        'use_ssl': False,
+        'bind_dn': 'cn=admin,dc=test,dc=com',
+        'bind_password': 'password',
+        'search_base': 'ou=users,dc=test,dc=com',
+        'search_filter': '(objectClass=person)',
+        'attr_mapping': {
+            'username': 'uid',
+            'email': 'mail',
+            'nickname': 'displayName'
+        },
+        'enabled': True,
+        'auto_create_user': True,
+        'sync_enabled': True,
+        'sync_interval': 30
+    })
 
-    @patch('api.db.services.ldap_service.LDAPConfigService.model')
     def test_create_config(self, mock_model):
         """测试创建LDAP配置"""
         # Mock返回值
         mock_instance = Mock()
         mock_model.create.return_value = mock_instance
         
-        # 调用方法
-        result = LDAPConfigService.create_config(self.config_data)
+        # 调用方法（create_config会写入id等字段，传入副本）
+        result = LDAPConfigService.create_config(dict(self.CONFIG_DATA))
         
         # 验证结果
         self.assertIsNotNone(result)
         mock_model.create.assert_called_once()
 
-    @patch('api.db.services.ldap_service.LDAPConfigService.model')
     def test_get_active_config(self, mock_model):
         """测试获取活跃配置"""
         # Mock返回值
         mock_instance = Mock()
         mock_model.select().where().first.return_value = mock_instance
+        LDAPConfigService.invalidate_active_config()
         
         # 调用方法
         result = LDAPConfigService.get_active_config()
@@ -80,35 +130,48 @@ class TestLDAPConfigService(unittest.TestCase):
         # 验证结果
         self.assertIsNotNone(result)
 
+    def test_get_active_config_cached(self, mock_model):
+        """测试活跃配置缓存与失效"""
+        LDAPConfigService.invalidate_active_config()
+        
+        first = LDAPConfigService.get_active_config()
+        second = LDAPConfigService.get_active_config()
+        self.assertIs(first, second)
+        self.assertEqual(mock_model.select.call_count, 1)
+        
+        LDAPConfigService.invalidate_active_config()
+        LDAPConfigService.get_active_config()
+        self.assertEqual(mock_model.select.call_count, 2)
+
 
+@patch.object(LDAPUserService, 'model')
 class TestLDAPUserService(unittest.TestCase):
     """测试LDAP用户服务"""
     
-    def setUp(self):
-        self.user_data = {
-            'dn': 'uid=testuser,ou=users,dc=test,dc=com',
-            'username': 'testuser',
-            'email': 'testuser@test.com',
-            'nickname': 'Test User',
-            'first_name': 'Test',
-            'last_name': 'User',
-            'attributes': {
-                'uid': ['testuser'],
-                'mail': ['testuser@test.com']
-            }
+    USER_DATA = MappingProxyType({
+        'dn': 'uid=testuser,ou=users,dc=test,dc=com',
+        'username': 'testuser',
+        'email': 'testuser@test.com',
+        'nickname': 'Test User',
+        'first_name': 'Test',
+        'last_name': 'User',
+        'attributes': {
+            'uid': ['testuser'],
+            'mail': ['testuser@test.com']
         }
+    })
         
-    @patch('api.db.services.ldap_service.LDAPUserService.model')
     def test_create_or_update_user(self, mock_model):
         """测试创建或更新用户"""
         # Mock没有找到现有用户
-        mock_model.select().where().first.return_value = None
+        mock_model.select().where().limit().sql.return_value = ('SELECT', ['config123', 'dn', 1])
+        mock_model.raw.return_value = []
         mock_instance = Mock()
         mock_model.create.return_value = mock_instance
         
         # 调用方法
         result, created = LDAPUserService.create_or_update_user(
-            'config123', self.user_data
+            'config123', dict(self.USER_DATA)
         )
         
         # 验证结果
@@ -116,16 +179,70 @@ class TestLDAPUserService(unittest.TestCase):
         self.assertTrue(created)
 
 
+    def test_create_or_update_existing_user(self, mock_model):
+        """测试更新已有用户时不再重新查询"""
+        existing = Mock()
+        mock_model.select().where().limit().sql.return_value = ('SELECT', ['config123', 'dn', 1])
+        mock_model.raw.return_value = [existing]
+        
+        result, created = LDAPUserService.create_or_update_user(
+            'config123', dict(self.USER_DATA)
+        )
+        
+        self.assertIs(result, existing)
+        self.assertFalse(created)
+        self.assertEqual(result.email, 'testuser@test.com')
+        mock_model.get_or_none.assert_not_called()
+        mock_model.raw.assert_called_once_with(
+            'SELECT', 'config123', self.USER_DATA['dn'], 1
+        )
+
+    def test_bulk_upsert(self, mock_model):
+        """测试批量写入用户"""
+        new_user = dict(self.USER_DATA, dn='uid=newuser,ou=users,dc=test,dc=com', username='newuser')
+        mock_model.select().where().tuples.return_value = [('user1', self.USER_DATA['dn'])]
+        
+        created_users, updated = LDAPUserService.bulk_upsert(
+            'config123', [dict(self.USER_DATA), new_user]
+        )
+        
+        self.assertEqual(len(created_users), 1)
+        self.assertEqual(updated, 1)
+        mock_model.insert_many.assert_called_once()
+
+    def test_mark_stale_users(self, mock_model):
+        """测试标记失效用户"""
+        mock_model.update().where().execute.return_value = 2
+        
+        result = LDAPUserService.mark_stale_users('config123', [self.USER_DATA['dn']])
+        
+        self.assertEqual(result, 2)
+
+    def test_count_by_status(self, mock_model):
+        """测试按状态统计用户"""
+        mock_model.select().where().group_by().tuples.return_value = [(True, 3), (False, 2)]
+        
+        counts = LDAPUserService.count_by_status('config123')
+        
+        self.assertEqual(counts, {'active': 3, 'inactive': 2, 'total': 5})
+
+
 class TestLDAPAuthenticator(unittest.TestCase):
     """测试LDAP认证器"""
     
+    @classmethod
+    def setUpClass(cls):
+        # 认证器不持有实例状态，所有测试共用一个实例
+        cls.authenticator = LDAPAuthenticator()
+        
     def setUp(self):
-        self.authenticator = LDAPAuthenticator()
+        patcher = patch.object(LDAPConfigService, 'get_active_config')
+        self.mock_get_config = patcher.start()
+        self.addCleanup(patcher.stop)
         
-    @patch('api.ldap.ldap_auth.LDAPConfigService.get_active_config')
-    def test_authenticate_user_no_config(self, mock_get_config):
+    def test_authenticate_user_no_config(self):
         """测试无配置时的认证"""
-        mock_get_config.return_value = None
+        self.mock_get_config.return_value = None
         
         success, user_info = self.authenticator.authenticate_user(
             'testuser', 'password'
@@ -134,14 +251,14 @@ class TestLDAPAuthenticator(unittest.TestCase):
         self.assertFalse(success)
         self.assertIsNone(user_info)
 
-    @patch('api.ldap.ldap_auth.ldap3')
-    @patch('api.ldap.ldap_auth.LDAPConfigService.get_active_config')
-    def test_authenticate_user_ldap_unavailable(self, mock_get_config, mock_ldap3):
+    @patch.object(ldap_auth, 'ldap3')
+    def test_authenticate_user_ldap_unavailable(self, mock_ldap3):
         """测试LDAP库不可用时的认证"""
         # 模拟配置存在但启用
         mock_config = Mock()
+        mock_config.id = 'config-ldap-unavailable'
         mock_config.enabled = True
-        mock_get_config.return_value = mock_config
+        self.mock_get_config.return_value = mock_config
         
         # 模拟ldap3不可用
         mock_ldap3 = None
@@ -154,18 +271,135 @@ class TestLDAPAuthenticator(unittest.TestCase):
         self.assertIsNone(user_info)
 
 
+    @staticmethod
+    def _search_config(config_id):
+        config = Mock()
+        config.id = config_id
+        config.enabled = True
+        config.user_dn_template = None
+        config.search_base = 'ou=users,dc=test,dc=com'
+        config.search_filter = '(&(objectClass=person)(uid={username}))'
+        config.attr_mapping = {'username': 'uid'}
+        return config
+        
+    @patch.object(LDAPAuthenticator, '_get_user_info')
+    @patch.object(LDAPAuthenticator, '_find_user_entry')
+    @patch.object(ldap_auth, 'LDAPConnectionManager')
+    @patch.object(ldap_auth, 'ldap3')
+    def test_authenticate_user_caches_dn(self, mock_ldap3, mock_conn_mgr,
+                                         mock_find_user_entry, mock_get_user_info):
+        """测试重复登录复用缓存的用户DN"""
+        mock_config = self._search_config('config-dn-cache')
+        self.mock_get_config.return_value = mock_config
+        user_dn = 'uid=testuser,ou=users,dc=test,dc=com'
+        mock_find_user_entry.return_value = (user_dn, {'dn': user_dn})
+        mock_get_user_info.return_value = {'dn': user_dn}
+        verify_credentials = mock_conn_mgr.return_value.verify_credentials
+        
+        verify_credentials.return_value = True
+        self.assertTrue(self.authenticator.authenticate_user('testuser', 'password')[0])
+        # 首次登录的搜索已返回用户属性，无需再次查询
+        mock_get_user_info.assert_not_called()
+        self.assertTrue(self.authenticator.authenticate_user('testuser', 'password')[0])
+        self.assertEqual(mock_find_user_entry.call_count, 1)
+        # 缓存命中时仍按登录过滤条件读取条目
+        mock_get_user_info.assert_called_once_with(
+            mock_conn_mgr.return_value.connection, user_dn, '(&(objectClass=person)(uid=testuser))'
+        )
+        
+        # 认证失败后清除缓存，下次重新查找DN
+        verify_credentials.return_value = False
+        self.assertFalse(self.authenticator.authenticate_user('testuser', 'wrong')[0])
+        verify_credentials.return_value = True
+        self.assertTrue(self.authenticator.authenticate_user('testuser', 'password')[0])
+        self.assertEqual(mock_find_user_entry.call_count, 2)
+
+    def test_find_user_entry_ldap3_response(self):
+        """测试使用ldap3真实搜索结果（CaseInsensitiveDict属性）查找用户"""
+        config = self._search_config('config-ldap3-response')
+        config.attr_mapping = dict(ATTR_MAPPING)
+        self.mock_get_config.return_value = config
+        connection = _mock_ldap_connection()
+        self.addCleanup(connection.unbind)
+        
+        user_dn, user_info = self.authenticator._find_user_entry(connection, 'testuser')
+        
+        self.assertEqual(user_dn, 'uid=testuser,ou=users,dc=test,dc=com')
+        self.assertEqual(user_info['email'], 'testuser@test.com')
+        self.assertEqual(user_info['nickname'], 'Test User')
+        self.assertEqual(
+            self.authenticator._get_user_info(connection, user_dn)['username'], 'testuser'
+        )
+
+    @patch.object(LDAPAuthenticator, '_get_user_info')
+    @patch.object(LDAPAuthenticator, '_find_user_entry')
+    @patch.object(ldap_auth, 'LDAPConnectionManager')
+    @patch.object(ldap_auth, 'ldap3')
+    def test_authenticate_user_cached_dn_rechecked(self, mock_ldap3, mock_conn_mgr,
+                                                   mock_find_user_entry, mock_get_user_info):
+        """测试缓存的DN不再符合登录条件或配置变更后重新搜索"""
+        mock_config = self._search_config('config-dn-recheck')
+        self.mock_get_config.return_value = mock_config
+        user_dn = 'uid=testuser,ou=users,dc=test,dc=com'
+        mock_find_user_entry.return_value = (user_dn, {'dn': user_dn})
+        mock_conn_mgr.return_value.verify_credentials.return_value = True
+        self.assertTrue(self.authenticator.authenticate_user('testuser', 'password')[0])
+        
+        # 用户已不满足过滤条件（例如被移出允许登录的组）
+        mock_find_user_entry.return_value = (None, None)
+        mock_get_user_info.return_value = None
+        self.assertFalse(self.authenticator.authenticate_user('testuser', 'password')[0])
+        self.assertEqual(mock_find_user_entry.call_count, 2)
+        mock_conn_mgr.return_value.verify_credentials.assert_called_once()
+        
+        # 配置写入后清除缓存
+        mock_find_user_entry.return_value = (user_dn, {'dn': user_dn})
+        self.assertTrue(self.authenticator.authenticate_user('testuser', 'password')[0])
+        LDAPConfigService.invalidate_active_config()
+        self.assertTrue(self.authenticator.authenticate_user('testuser', 'password')[0])
+        self.assertEqual(mock_find_user_entry.call_count, 4)
+
+
+    @patch.object(LDAPAuthenticator, '_find_user_entry')
+    @patch.object(ldap_auth, 'LDAPConnectionManager')
+    @patch.object(ldap_auth, 'ldap3')
+    def test_authenticate_user_failed_login_cached(self, mock_ldap3, mock_conn_mgr,
+                                                   mock_find_user_entry):
+        """测试重复的失败登录不再访问LDAP"""
+        mock_config = Mock()
+        mock_config.id = 'config-failed-login'
+        mock_config.enabled = True
+        mock_config.user_dn_template = None
+        self.mock_get_config.return_value = mock_config
+        user_dn = 'uid=testuser,ou=users,dc=test,dc=com'
+        mock_find_user_entry.return_value = (user_dn, {'dn': user_dn})
+        verify_credentials = mock_conn_mgr.return_value.verify_credentials
+        verify_credentials.return_value = False
+        
+        self.assertFalse(self.authenticator.authenticate_user('testuser', 'wrong')[0])
+        self.assertFalse(self.authenticator.authenticate_user('testuser', 'wrong')[0])
+        self.assertEqual(verify_credentials.call_count, 1)
+        
+        # 不同的密码仍然会校验
+        verify_credentials.return_value = True
+        self.assertTrue(self.authenticator.authenticate_user('testuser', 'password')[0])
+        self.assertEqual(verify_credentials.call_count, 2)
+
+
 class TestLDAPConnectionManager(unittest.TestCase):
     """测试LDAP连接管理器"""
     
-    def setUp(self):
-        self.config = Mock()
-        self.config.server_host = 'ldap.test.com'
-        self.config.server_port = 389
-        self.config.use_ssl = False
-        self.config.bind_dn = 'cn=admin,dc=test,dc=com'
-        self.config.bind_password = 'password'
-        
-    @patch('api.ldap.ldap_auth.ldap3')
+    @classmethod
+    def setUpClass(cls):
+        cls.config = SimpleNamespace(
+            server_host='ldap.test.com',
+            server_port=389,
+            use_ssl=False,
+            bind_dn='cn=admin,dc=test,dc=com',
+            bind_password='password'
+        )
+        
+    @patch.object(ldap_auth, 'ldap3')
     def test_create_server(self, mock_ldap3):
         """测试创建服务器连接"""
         # 模拟ldap3可用
@@ -179,35 +413,370 @@ class TestLDAPConnectionManager(unittest.TestCase):
         # 验证服务器创建
         mock_ldap3.Server.assert_called_once()
 
+    @patch.object(ldap_auth, 'Connection')
+    def test_verify_credentials_uses_separate_connection(self, mock_connection):
+        """测试用户密码在独立的SYNC连接上校验，失败的绑定只发送一次"""
+        conn_mgr = LDAPConnectionManager(self.config)
+        conn_mgr._pool = Mock()
+        conn_mgr.connection = pooled = Mock()
+        user_dn = 'uid=testuser,ou=users,dc=test,dc=com'
+        
+        self.assertTrue(conn_mgr.verify_credentials(user_dn, 'password'))
+        mock_connection.return_value.unbind.assert_called_once()
+        
+        mock_connection.side_effect = ldap_auth.LDAPInvalidCredentialsResult()
+        self.assertFalse(conn_mgr.verify_credentials(user_dn, 'wrong'))
+        args, kwargs = mock_connection.call_args
+        self.assertIs(args[0], conn_mgr._pool.server_pool)
+        self.assertEqual(kwargs['client_strategy'], ldap_auth.SYNC)
+        # 池中的连接始终以服务账号绑定
+        pooled.rebind.assert_not_called()
+
+
+class TestLDAPConnectionPool(unittest.TestCase):
+    """测试LDAP连接池"""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.config = SimpleNamespace(
+            server_host='ldap.test.com',
+            server_port=389,
+            use_ssl=False,
+            bind_dn='cn=admin,dc=test,dc=com',
+            bind_password='password',
+            max_pool_size=1
+        )
+        
+    @patch.object(ldap_auth, 'Connection')
+    @patch.object(ldap_auth, 'ldap3')
+    def test_release_reuses_healthy_connection(self, mock_ldap3, mock_connection):
+        """测试健康连接被复用"""
+        pool = LDAPConnectionPool(self.config)
+        conn = pool.acquire()
+        conn.closed = False
+        conn.bound = True
+        pool.release(conn)
+        
+        self.assertIs(pool.acquire(), conn)
+        mock_connection.assert_called_once()
+
+    @patch.object(ldap_auth.time, 'monotonic')
+    @patch.object(ldap_auth, 'Connection')
+    @patch.object(ldap_auth, 'ldap3')
+    def test_release_drops_expired_connection(self, mock_ldap3, mock_connection, mock_monotonic):
+        """测试超过生命周期的连接不再复用"""
+        mock_monotonic.return_value = 0
+        pool = LDAPConnectionPool(self.config)
+        conn = pool.acquire()
+        conn.closed = False
+        conn.bound = True
+        
+        mock_monotonic.return_value = LDAP_POOL_LIFETIME + 1
+        pool.release(conn)
+        
+        conn.unbind.assert_called_once()
+        pool.acquire()
+        self.assertEqual(mock_connection.call_count, 2)
+
+    @patch.object(ldap_auth, 'Connection')
+    @patch.object(ldap_auth, 'ldap3')
+    def test_acquire_exhausted(self, mock_ldap3, mock_connection):
+        """测试连接池耗尽"""
+        pool = LDAPConnectionPool(self.config)
+        pool.acquire()
+        
+        with self.assertRaises(ConnectionError):
+            pool.acquire(timeout=0.01)
+
 
 class TestLDAPSyncService(unittest.TestCase):
     """测试LDAP同步服务"""
     
+    @classmethod
+    def setUpClass(cls):
+        # 同步状态保存在模块级，所有测试共用一个实例
+        cls.sync_service = LDAPSyncService()
+        
     def setUp(self):
-        self.sync_service = LDAPSyncService()
+        patcher = patch.object(LDAPConfigService, 'get_active_config')
+        self.mock_get_config = patcher.start()
+        self.addCleanup(patcher.stop)
         
-    @patch('api.ldap.ldap_auth.LDAPConfigService.get_active_config')
-    def test_sync_users_no_config(self, mock_get_config):
+    def test_sync_users_no_config(self):
         """测试无配置时的同步"""
-        mock_get_config.return_value = None
+        self.mock_get_config.return_value = None
         
         success, stats = self.sync_service.sync_users()
         
         self.assertFalse(success)
         self.assertEqual(stats, {})
 
-    @patch('api.ldap.ldap_auth.LDAPConfigService.get_active_config')
-    def test_sync_users_disabled(self, mock_get_config):
+    def test_sync_users_disabled(self):
         """测试同步被禁用时"""
         mock_config = Mock()
         mock_config.enabled = False
-        mock_get_config.return_value = mock_config
+        self.mock_get_config.return_value = mock_config
         
         success, stats = self.sync_service.sync_users()
         
         self.assertFalse(success)
         self.assertEqual(stats, {})
 
+    def test_incremental_since(self):
+        """测试增量同步的时间下限"""
+        config = Mock()
+        config.id = 'config-incremental'
+        config.search_base = 'dc=test,dc=com'
+        config.search_filter = '(objectClass=person)'
+        config.attr_mapping = {'username': 'uid'}
+        now = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+        
+        # 首次同步为完整同步
+        self.assertIsNone(self.sync_service._incremental_since(config, now))
+        self.sync_service._record_sync(config, now, full=True)
+        
+        later = now + timedelta(minutes=10)
+        self.assertEqual(
+            self.sync_service._incremental_since(config, later),
+            now - LDAP_INCREMENTAL_OVERLAP
+        )
+        
+        # 搜索条件变化或超过完整同步间隔时重新完整同步
+        self.assertIsNone(self.sync_service._incremental_since(config, now + LDAP_FULL_SYNC_INTERVAL))
+        config.search_filter = '(objectClass=inetOrgPerson)'
+        self.assertIsNone(self.sync_service._incremental_since(config, later))
+
+    @patch.object(ldap_auth, 'DB')
+    @patch.object(LDAPUserService, 'link_system_users')
+    @patch.object(ldap_auth, 'UserService')
+    def test_create_system_users(self, mock_user_service, mock_link, mock_db):
+        """测试按邮箱批量关联系统用户"""
+        mock_user_service.model.select().where().tuples.return_value = [('sys1', 'a@test.com')]
+        existing = Mock(id='ldap1', email='a@test.com')
+        new = Mock(id='ldap2', email='b@test.com', ldap_username='b', nickname=None)
+        
+        errors = self.sync_service._create_system_users([existing, new])
+        
+        self.assertEqual(errors, 0)
+        mock_user_service._save.assert_called_once()
+        links = mock_link.call_args[0][0]
+        self.assertEqual(links['ldap1'], 'sys1')
+        self.assertEqual(links['ldap2'], mock_user_service._save.call_args[1]['id'])
+
+    def test_prefetch_batches(self):
+        """测试后台预取分批结果并传递异常"""
+        self.assertEqual(list(_prefetch_batches(iter(range(5)), 2)), [[0, 1], [2, 3], [4]])
+        
+        def failing_search():
+            yield {'dn': 'uid=a'}
+            raise ConnectionError("search failed")
+            
+        with self.assertRaises(ConnectionError):
+            list(_prefetch_batches(failing_search(), 1))
+
+    def test_get_all_ldap_users_ldap3_response(self):
+        """测试分页读取ldap3真实搜索结果"""
+        config = Mock()
+        config.search_base = 'ou=users,dc=test,dc=com'
+        config.search_filter = '(objectClass=person)'
+        config.attr_mapping = dict(ATTR_MAPPING)
+        connection = _mock_ldap_connection()
+        self.addCleanup(connection.unbind)
+        
+        users = list(self.sync_service._get_all_ldap_users(connection, config))
+        
+        self.assertEqual(len(users), 1)
+        self.assertEqual(users[0]['dn'], 'uid=testuser,ou=users,dc=test,dc=com')
+        self.assertEqual(users[0]['username'], 'testuser')
+        self.assertTrue(users[0]['is_active'])
+
+
+class TestLDAPSyncServiceDatabase(unittest.TestCase):
+    """在真实的SQLite数据库上测试LDAP同步
+
+    同步事务内调用的服务方法若自行打开并关闭连接，关闭时会因事务未结束而失败，
+    使用Mock的测试无法发现这类问题。
+    """
+    
+    MODELS = (LDAPConfig, LDAPUser, User)
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.sync_service = LDAPSyncService()
+        
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.db = SqliteDatabase(os.path.join(tmp_dir.name, 'ldap_sync.db'))
+        bind_ctx = self.db.bind_ctx(self.MODELS)
+        bind_ctx.__enter__()
+        self.addCleanup(bind_ctx.__exit__, None, None, None)
+        self.addCleanup(self.db.close)
+        self.db.create_tables(self.MODELS)
+        
+        for patcher in (
+            patch.object(ldap_auth, 'DB', self.db),
+            patch.object(ldap_service, 'DB', self.db),
+            # LDAP服务器与同步状态写入不在测试范围内
+            patch.object(ldap_auth, 'LDAPConnectionManager'),
+            patch.object(LDAPConfigService, 'update_sync_status'),
+            patch.object(LDAPConfigService, 'get_active_config'),
+            patch.object(LDAPSyncService, '_get_all_ldap_users'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+            
+        self.config = LDAPConfig.create(
+            id='config-sqlite',
+            name='Test LDAP',
+            server_host='ldap.test.com',
+            search_base='ou=users,dc=test,dc=com',
+            attr_mapping={'username': 'uid', 'email': 'mail'},
+            enabled=True,
+            auto_create_user=True,
+            sync_enabled=True
+        )
+        LDAPConfigService.get_active_config.return_value = self.config
+        
+    @staticmethod
+    def _ldap_user(username):
+        return {
+            'dn': f'uid={username},ou=users,dc=test,dc=com',
+            'username': username,
+            'email': f'{username}@test.com',
+            'attributes': {'uid': [username]},
+            'is_active': True
+        }
+        
+    def _directory(self, *usernames):
+        LDAPSyncService._get_all_ldap_users.return_value = iter([
+            self._ldap_user(username) for username in usernames
+        ])
+        
+    def test_sync_users_writes_users(self):
+        """测试同步写入LDAP用户并创建关联的系统用户"""
+        self._directory('alice', 'bob')
+        
+        success, stats = self.sync_service.sync_users(full=True)
+        
+        self.assertTrue(success)
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual(stats['errors'], 0)
+        users = list(LDAPUser.select().order_by(LDAPUser.ldap_username))
+        self.assertEqual([user.ldap_username for user in users], ['alice', 'bob'])
+        self.assertTrue(all(user.user_id for user in users))
+        self.assertEqual(User.select().count(), 2)
+        LDAPConfigService.update_sync_status.assert_called_with(
+            self.config.id, 'completed', ANY
+        )
+        
+    def test_sync_users_marks_stale_users(self):
+        """测试完整同步后不再存在的用户被标记为失效"""
+        self._directory('alice', 'bob')
+        self.assertTrue(self.sync_service.sync_users(full=True)[0])
+        
+        self._directory('alice')
+        success, stats = self.sync_service.sync_users(full=True)
+        
+        self.assertTrue(success)
+        self.assertEqual(stats['updated'], 1)
+        self.assertEqual(stats['deactivated'], 1)
+        self.assertFalse(LDAPUser.get(LDAPUser.ldap_username == 'bob').is_active)
+        
+    @patch.dict(ldap_service._lookup_sql_cache, clear=True)
+    def test_get_by_email_after_null_lookup(self):
+        """测试按空值查询不影响同一字段后续查询缓存的SQL"""
+        for username, email in (('alice', 'alice@test.com'), ('carol', None)):
+            LDAPUser.create(
+                id=f'ldap-user-{username}', ldap_config_id=self.config.id, ldap_username=username,
+                ldap_dn=f'uid={username},ou=users,dc=test,dc=com', email=email
+            )
+            
+        self.assertEqual(
+            LDAPUserService._get_by_field(self.config.id, 'email', None).ldap_username, 'carol'
+        )
+        self.assertEqual(
+            LDAPUserService._get_by_field(self.config.id, 'email', 'alice@test.com').ldap_username, 'alice'
+        )
+        self.assertIsNone(LDAPUserService._get_by_field(self.config.id, 'email', 'nobody@test.com'))
+        # 空值会被编译为IS比较，缓存的SQL必须使用等值比较（MySQL不接受IS '值'）
+        cached_sql = ldap_service._lookup_sql_cache[(LDAPUser, 'email')][0]
+        self.assertNotIn(' IS ', cached_sql)
+        
+    @patch.object(ldap_auth, 'UPSERT_BATCH_SIZE', 1)
+    def test_sync_users_commits_each_batch(self):
+        """测试每批用户单独提交，目录读取失败时不标记失效用户"""
+        self._directory('alice', 'bob')
+        self.assertTrue(self.sync_service.sync_users(full=True)[0])
+        
+        def failing_directory(*args):
+            yield self._ldap_user('carol')
+            raise ConnectionError("search failed")
+            
+        LDAPSyncService._get_all_ldap_users.side_effect = failing_directory
+        success, stats = self.sync_service.sync_users(full=True)
+        
+        self.assertFalse(success)
+        # 读取失败前的批次已提交，且不执行失效标记
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['deactivated'], 0)
+        self.assertTrue(LDAPUser.get(LDAPUser.ldap_username == 'carol').is_active)
+        self.assertEqual(LDAPUser.select().where(LDAPUser.is_active).count(), 3)
+        LDAPConfigService.update_sync_status.assert_called_with(self.config.id, 'error')
+
+
+class TestLDAPScheduler(unittest.TestCase):
+    """测试LDAP调度器"""
+    
+    @patch.object(LDAPConfigService, 'get_active_config', return_value=None)
+    @patch.object(ldap_scheduler, 'RedisDistributedLock')
+    def test_force_sync_skipped_while_sync_running(self, mock_redis_lock, mock_get_config):
+        """测试同步进行中时不会重复执行"""
+        scheduler = LDAPScheduler()
+        scheduler.sync_service = Mock()
+        
+        with _local_sync_lock:
+            self.assertFalse(scheduler.force_sync())
+        scheduler.sync_service.sync_users.assert_not_called()
+        mock_redis_lock.assert_not_called()
+        
+        mock_redis_lock.return_value.acquire.return_value = True
+        scheduler.sync_service.sync_users.return_value = (True, {})
+        self.assertTrue(scheduler.force_sync())
+        mock_redis_lock.return_value.release.assert_called_once()
+
+    def test_next_check_delay(self):
+        """测试下一次检查的等待秒数"""
+        config = SimpleNamespace(id='config-check-delay', sync_interval=60)
+        now = datetime.now()
+        self.assertEqual(_seconds_until_sync(config, now), 0.0)
+        
+        with patch.dict(ldap_scheduler._last_sync_time, {config.id: now - timedelta(seconds=50)}):
+            self.assertEqual(_seconds_until_sync(config, now), 10.0)
+        # 等待时间不为负，且最长为一个配置缓存周期
+        self.assertEqual(_next_check_delay(-5.0), 0.0)
+        self.assertEqual(_next_check_delay(3600.0), 30.0)
+
+    @patch.object(ldap_scheduler, '_run_once')
+    @patch.object(ldap_scheduler, '_get_sync_config')
+    def test_check_and_sync_delays(self, mock_get_sync_config, mock_run_once):
+        """测试同步和异步调度器在空闲、同步和出错时返回的等待秒数"""
+        config = SimpleNamespace(id='config-check-and-sync', sync_interval=60)
+        check_sync = LDAPScheduler()._check_and_sync
+        check_async = AsyncLDAPScheduler()._check_and_sync
+        
+        for check_and_sync in (check_sync, lambda: asyncio.run(check_async())):
+            mock_get_sync_config.side_effect = None
+            mock_get_sync_config.return_value = None
+            self.assertEqual(check_and_sync(), 10.0)
+            
+            mock_get_sync_config.return_value = config
+            self.assertEqual(check_and_sync(), 30.0)
+            mock_run_once.assert_called_with(config)
+            
+            mock_get_sync_config.side_effect = RuntimeError("config unavailable")
+            self.assertEqual(check_and_sync(), 30.0)
+
 
 class TestLDAPIntegration(unittest.TestCase):
     """LDAP集成测试"""
@@ -239,56 +808,65 @@ class TestLDAPIntegration(unittest.TestCase):
         # 由于需要完整的Flask应用环境，这里只做基本验证
         self.assertTrue(True)  # 占位符测试
 
-    def test_ldap_config_validation(self):
-        """测试LDAP配置验证"""
-        # 测试必需字段
-        config = {
-            'name': 'Test LDAP',
-            'server_host': 'ldap.test.com',
-            'server_port': 389,
-            'search_base': 'ou=users,dc=test,dc=com'
-        }
-        
-        # 验证必需字段存在
-        required_fields = ['name', 'server_host', 'server_port', 'search_base']
-        for field in required_fields:
-            self.assertIn(field, config)
-            
-        # 验证端口范围
-        self.assertGreater(config['server_port'], 0)
-        self.assertLessEqual(config['server_port'], 65535)
-
     def test_user_attribute_mapping(self):
         """测试用户属性映射"""
-        attr_mapping = {
-            'username': 'uid',
-            'email': 'mail',
-            'nickname': 'displayName',
-            'first_name': 'givenName',
-            'last_name': 'sn'
+        # 测试映射转换：先将多值属性统一取首个值，再按映射一次性取出
+        normalized = {
+            attr: (value[0] if value else None) if isinstance(value, list) else value
+            for attr, value in LDAP_ATTRS.items()
         }
-        
-        # 模拟LDAP属性
-        ldap_attrs = {
-            'uid': ['testuser'],
-            'mail': ['testuser@test.com'],
-            'displayName': ['Test User'],
-            'givenName': ['Test'],
-            'sn': ['User']
+        mapped_data = {
+            key: normalized[ldap_attr]
+            for key, ldap_attr in ATTR_MAPPING.items() if ldap_attr in normalized
         }
-        
-        # 测试映射转换
-        mapped_data = {}
-        for key, ldap_attr in attr_mapping.items():
-            if ldap_attr in ldap_attrs:
-                value = ldap_attrs[ldap_attr]
-                mapped_data[key] = value[0] if isinstance(value, list) and value else None
-                
+
         self.assertEqual(mapped_data['username'], 'testuser')
         self.assertEqual(mapped_data['email'], 'testuser@test.com')
         self.assertEqual(mapped_data['nickname'], 'Test User')
 
+    def test_normalize_ldap_entry(self):
+        """测试LDAP条目属性规范化"""
+        attributes = {
+            'uid': ['testuser', 'alias'],
+            'Mail': 'testuser@test.com',
+            'displayName': [],
+            'uidNumber': 1001
+        }
+        
+        user_data = normalize_ldap_entry(
+            'uid=testuser,ou=users,dc=test,dc=com', attributes, {'email': 'mail'}
+        )
+        
+        self.assertEqual(user_data['dn'], 'uid=testuser,ou=users,dc=test,dc=com')
+        self.assertEqual(user_data['username'], 'testuser')
+        self.assertEqual(user_data['email'], 'testuser@test.com')
+        self.assertIsNone(user_data['nickname'])
+        self.assertIsNone(user_data['first_name'])
+        self.assertEqual(user_data['attributes']['uidNumber'], '1001')
+
+
+@pytest.fixture(scope="module")
+def ldap_config():
+    """只包含必需字段的LDAP配置"""
+    return MappingProxyType({
+        'name': 'Test LDAP',
+        'server_host': 'ldap.test.com',
+        'server_port': 389,
+        'search_base': 'ou=users,dc=test,dc=com'
+    })
+
+
+@pytest.mark.parametrize("field", sorted(REQUIRED_CONFIG_FIELDS))
+def test_ldap_config_required_field(ldap_config, field):
+    """测试LDAP配置必需字段存在"""
+    assert field in ldap_config
+
+
+def test_ldap_config_port_range(ldap_config):
+    """测试LDAP配置端口范围"""
+    assert 0 < ldap_config['server_port'] <= 65535
+
 
 if __name__ == '__main__':
-    # 运行测试
-    unittest.main()
\ No newline at end of file
+    # 运行测试（模块级的pytest测试函数只能通过pytest运行）
+    pytest.main([__file__])
\ No newline at end of file
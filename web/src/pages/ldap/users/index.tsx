@@ -71,9 +71,24 @@ const LDAPUsersPage: React.FC = () => {
     }
   };
 
-  const showUserDetail = (user: LDAPUser) => {
+  const showUserDetail = async (user: LDAPUser) => {
     setSelectedUser(user);
     setDetailVisible(true);
+    // 列表不包含原始LDAP属性，打开详情时单独加载
+    try {
+      const response = await ldapService.getUser(user.id);
+      if (response.code === 0 && response.data) {
+        setSelectedUser(current =>
+          current?.id === user.id
+            ? { ...current, ldap_attributes: response.data.ldap_attributes }
+            : current
+        );
+      } else {
+        message.error(response.message || '获取用户详情失败');
+      }
+    } catch (error) {
+      message.error('加载用户详情时发生错误');
+    }
   };
 
   const filteredUsers = users.filter(user => {
@@ -37,7 +37,8 @@ export interface LDAPUser {
   nickname?: string;
   first_name?: string;
   last_name?: string;
-  ldap_attributes: Record<string, any>;
+  // Only returned by getUser; the user list omits the raw attributes
+  ldap_attributes?: Record<string, any>;
   is_active: boolean;
   last_login_time?: string;
   last_sync_time?: string;
@@ -104,7 +105,7 @@ class LDAPService {
   }
 
   // Force sync LDAP users
-  async forceSync(): Promise<{ data: boolean; code: number; message: string }> {
+  async forceSync(): Promise<{ data: { job_id: string; status: string }; code: number; message: string }> {
     return request('/api/v1/ldap/sync', {
       method: 'POST',
     });
@@ -114,7 +115,14 @@ class LDAPService {
   async getUsers(activeOnly: boolean = true): Promise<{ data: LDAPUser[]; code: number; message: string }> {
     return request('/api/v1/ldap/users', {
       method: 'GET',
-      params: { active_only: activeOnly },
+      params: { active_only: activeOnly, detail: false },
+    });
+  }
+
+  // Get one LDAP user including the raw LDAP attributes
+  async getUser(userId: string): Promise<{ data: LDAPUser; code: number; message: string }> {
+    return request(`/api/v1/ldap/users/${userId}`, {
+      method: 'GET',
     });
   }
 